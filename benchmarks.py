@@ -0,0 +1,304 @@
+import os
+import sys
+import time
+import json
+import random
+import shutil
+import tempfile
+import tracemalloc
+from contextlib import redirect_stdout
+
+import filecompare
+
+BENCHMARKS = ('compare_directories', 'process_diff', 'generate_comparison_images',
+              'render_cache', 'sql_modif', 'sql_normalizer')
+
+WORDS = ['SELECT', 'FROM', 'WHERE', 'JOIN', 'id', 'nombre', 'fecha', 'total',
+         'if', 'return', 'var', '=', '+', '(', ')', ';', 'dbo.Tabla', 'x']
+COMMON_LINES = ['{', '}', '    }', 'END', 'GO', 'BEGIN', '    return result;', 'else',
+                '        break;', '    END', ')', 'AS', '/// </summary>', '#endregion']
+
+def random_line(rng, line_length, repeat_ratio=0.4):
+    """Línea sintética; una fracción se repite como en código real"""
+    if rng.random() < repeat_ratio:
+        return rng.choice(COMMON_LINES)
+    words = []
+    length = 0
+    while length < line_length:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)[:line_length]
+
+def mutate_lines(lines, change_density, rng):
+    """Aplica modificaciones, altas y bajas a una fracción de las líneas"""
+    result = []
+    for line in lines:
+        if rng.random() >= change_density:
+            result.append(line)
+            continue
+        op = rng.random()
+        if op < 0.5:
+            result.append(line + ' -- modificado')
+        elif op < 0.75:
+            result.append(line)
+            result.append('-- línea nueva')
+        # else: línea eliminada
+    return result
+
+def generate_tree_pair(root, files=50, lines=500, change_density=0.02, line_length=60,
+                       changed_files=0.5, new_files=0.05, seed=0):
+    """
+    Genera root/base y root/mod reproducibles: changed_files es la fracción
+    de archivos con cambios (con change_density de líneas cambiadas) y
+    new_files la fracción de archivos que solo existen en mod.
+    Devuelve (dir1, dir2).
+    """
+    rng = random.Random(seed)
+    dir1 = os.path.join(root, 'base')
+    dir2 = os.path.join(root, 'mod')
+    os.makedirs(dir1, exist_ok=True)
+    os.makedirs(dir2, exist_ok=True)
+    for idx in range(files):
+        content = [random_line(rng, line_length) for _ in range(lines)]
+        name = f"archivo_{idx:05d}.cs"
+        if rng.random() < new_files:
+            _write_lines(os.path.join(dir2, name), content)
+            continue
+        _write_lines(os.path.join(dir1, name), content)
+        if rng.random() < changed_files:
+            content = mutate_lines(content, change_density, rng)
+        _write_lines(os.path.join(dir2, name), content)
+    return dir1, dir2
+
+def generate_sql_corpus(root, files=50, statements=100, line_length=60, seed=0):
+    """Genera archivos .sql reproducibles con SELECT/UPDATE/DELETE, JOINs y comentarios"""
+    rng = random.Random(seed)
+    os.makedirs(root, exist_ok=True)
+    tables = [f"dbo.Tabla{n}" for n in range(20)]
+    for idx in range(files):
+        lines = []
+        for _ in range(statements):
+            table, other = rng.sample(tables, 2)
+            kind = rng.random()
+            if kind < 0.6:
+                join = rng.choice(['JOIN', 'INNER JOIN', 'LEFT JOIN', 'join'])
+                lines += [f"SELECT t.id, t.nombre, o.total -- {random_line(rng, line_length // 2, 0)}",
+                          f"FROM {table} t",
+                          f"{join} {other} o ON o.id = t.id",
+                          f"WHERE t.fecha > '2020-01-01' AND EXISTS (SELECT 1 FROM {other} x WHERE x.id = t.id);"]
+            elif kind < 0.8:
+                lines += [f"UPDATE t SET t.total = o.total",
+                          f"FROM {table} t JOIN {other} o ON o.id = t.id;"]
+            else:
+                lines += [f"DELETE FROM {table} WHERE id IN (SELECT id FROM {other});"]
+            if rng.random() < 0.1:
+                lines.append('GO')
+        _write_lines(os.path.join(root, f"script_{idx:05d}.sql"), lines)
+    return root
+
+def _write_lines(path, lines):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines))
+        f.write('\n')
+
+def _tree_stats(*paths):
+    """(archivos, bytes, líneas) de una lista de archivos o directorios"""
+    files = total_bytes = total_lines = 0
+    for path in paths:
+        targets = [path] if os.path.isfile(path) else [
+            os.path.join(dirpath, name) for dirpath, _, names in os.walk(path) for name in names]
+        for target in targets:
+            files += 1
+            total_bytes += os.path.getsize(target)
+            with open(target, 'rb') as f:
+                total_lines += sum(1 for _ in f)
+    return files, total_bytes, total_lines
+
+def measure(func, files, total_bytes, total_lines, repeat=1, memory=True, setup=None):
+    """
+    Ejecuta func (con setup previo opcional, fuera del tiempo medido) y
+    devuelve throughput del mejor tiempo; la memoria pico se mide en una
+    pasada adicional con tracemalloc para no distorsionar los tiempos.
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            func()
+        timings.append(time.perf_counter() - start)
+
+    best = min(timings)
+    result = {
+        'segundos': best,
+        'archivos': files,
+        'mb': total_bytes / 2**20,
+        'lineas': total_lines,
+        'archivos_s': files / best if best else None,
+        'mb_s': total_bytes / 2**20 / best if best else None,
+        'lineas_s': total_lines / best if best else None,
+    }
+    if memory:
+        if setup:
+            setup()
+        tracemalloc.start()
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            func()
+        result['memoria_pico_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return result
+
+def bench_compare_directories(work_dir, args):
+    dir1, dir2 = generate_tree_pair(os.path.join(work_dir, 'arbol'), args.files, args.lines,
+                                    args.change_density, args.line_length, seed=args.seed)
+    output_dir = os.path.join(work_dir, 'salida')
+    files, total_bytes, total_lines = _tree_stats(dir1, dir2)
+
+    def setup():
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    def run():
+        filecompare.compare_directories(dir1, dir2, output_dir, renderer=args.renderer,
+                                        workers=args.workers, result_cache=False)
+    return measure(run, files, total_bytes, total_lines, args.repeat, args.memory, setup)
+
+def bench_process_diff(work_dir, args):
+    dir1, dir2 = generate_tree_pair(os.path.join(work_dir, 'arbol_diff'), args.files, args.lines,
+                                    args.change_density, args.line_length, changed_files=1.0,
+                                    new_files=0, seed=args.seed)
+    pairs = [(filecompare.read_lines(os.path.join(dir1, name)),
+              filecompare.read_lines(os.path.join(dir2, name))) for name in sorted(os.listdir(dir1))]
+    files, total_bytes, total_lines = _tree_stats(dir1, dir2)
+
+    def run():
+        for file1_lines, file2_lines in pairs:
+            filecompare.build_hunks(file1_lines, file2_lines, 2, 5, algorithm=args.engine)
+    return measure(run, files, total_bytes, total_lines, args.repeat, args.memory)
+
+def bench_generate_comparison_images(work_dir, args, render_cache=True):
+    rng = random.Random(args.seed)
+    lines_to_show = []
+    for i in range(args.lines * 4):
+        content = random_line(rng, args.line_length)
+        kind = rng.random()
+        if kind < args.change_density:
+            lines_to_show.append(('del', i, content, None))
+            lines_to_show.append(('add', i, content + ' -- modificado', None))
+        elif kind < 0.05:
+            lines_to_show.append(('sep', None, None, None))
+        else:
+            lines_to_show.append(('ctx', i, content, None))
+    output_path = os.path.join(work_dir, 'render', 'bench.png')
+    total_bytes = sum(len(line[2] or '') for line in lines_to_show)
+
+    def run():
+        filecompare.generate_comparison_images(lines_to_show, output_path, 1, 1000, 0, False,
+                                               render_cache=render_cache)
+    return measure(run, 1, total_bytes, len(lines_to_show), args.repeat, args.memory)
+
+def bench_render_cache(work_dir, args):
+    """Antes/después del caché de renderizado sobre el mismo diff"""
+    before = bench_generate_comparison_images(work_dir, args, render_cache=False)
+    after = bench_generate_comparison_images(work_dir, args, render_cache=True)
+    return {'antes': before, 'despues': after,
+            'aceleracion': before['segundos'] / after['segundos']}
+
+def bench_sql_modif(work_dir, args):
+    """process_directory (reescritura en disco) sobre un corpus .sql"""
+    import sql_modif
+
+    corpus = generate_sql_corpus(os.path.join(work_dir, 'sql_original'), args.files,
+                                 args.lines // 4 or 1, args.line_length, seed=args.seed)
+    target = os.path.join(work_dir, 'sql_modif')
+    state_dir = os.path.join(work_dir, 'sql_modif_state')
+    files, total_bytes, total_lines = _tree_stats(corpus)
+
+    # process_directory reescribe los archivos: cada pasada parte de una copia
+    # limpia y sin estado incremental
+    def setup():
+        shutil.rmtree(target, ignore_errors=True)
+        shutil.rmtree(state_dir, ignore_errors=True)
+        shutil.copytree(corpus, target)
+
+    def run():
+        sql_modif.process_directory(target, workers=args.workers, state_dir=state_dir)
+    return measure(run, files, total_bytes, total_lines, args.repeat, args.memory, setup)
+
+def bench_sql_normalizer(work_dir, args):
+    """SQLNormalizer.normalize_content sobre un corpus en memoria"""
+    import sql_normalizer
+
+    corpus = generate_sql_corpus(os.path.join(work_dir, 'sql_normalizer'), args.files,
+                                 args.lines // 4 or 1, args.line_length, seed=args.seed)
+    paths = sorted(os.path.join(corpus, name) for name in os.listdir(corpus))
+    contents = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            contents.append(f.read())
+    files, total_bytes, total_lines = _tree_stats(corpus)
+    normalizer = sql_normalizer.SQLNormalizer()
+
+    def run():
+        for content in contents:
+            normalizer.normalize_content(content)
+    return measure(run, files, total_bytes, total_lines, args.repeat, args.memory)
+
+def run_benchmarks(args):
+    """Ejecuta los benchmarks seleccionados y devuelve el reporte"""
+    runners = {
+        'compare_directories': bench_compare_directories,
+        'process_diff': bench_process_diff,
+        'generate_comparison_images': bench_generate_comparison_images,
+        'render_cache': bench_render_cache,
+        'sql_modif': bench_sql_modif,
+        'sql_normalizer': bench_sql_normalizer,
+    }
+    report = {
+        'python': sys.version.split()[0],
+        'parametros': {name: getattr(args, name) for name in
+                       ('files', 'lines', 'change_density', 'line_length', 'seed',
+                        'workers', 'engine', 'renderer', 'repeat')},
+        'resultados': {},
+    }
+    with tempfile.TemporaryDirectory(prefix='filecompare_bench_') as work_dir:
+        for name in args.only or BENCHMARKS:
+            print(f"Ejecutando {name}...", file=sys.stderr)
+            report['resultados'][name] = runners[name](work_dir, args)
+    return report
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmarks de filecompare y de los normalizadores SQL')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS,
+                       help='Ejecutar solo estos benchmarks')
+    parser.add_argument('--files', type=int, default=50, help='Archivos por árbol o corpus')
+    parser.add_argument('--lines', type=int, default=500, help='Líneas por archivo')
+    parser.add_argument('--change-density', type=float, default=0.02,
+                       help='Fracción de líneas cambiadas en los archivos modificados')
+    parser.add_argument('--line-length', type=int, default=60, help='Longitud de cada línea')
+    parser.add_argument('--seed', type=int, default=0, help='Semilla del generador')
+    parser.add_argument('--workers', type=int, default=1, help='Procesos para compare_directories y sql_modif')
+    parser.add_argument('--engine', choices=filecompare.DIFF_ENGINES, default='myers',
+                       help='Motor de diferencias para process_diff')
+    parser.add_argument('--format', choices=sorted(filecompare.RENDERERS), default='png',
+                       dest='renderer', help='Formato de salida para compare_directories')
+    parser.add_argument('--repeat', type=int, default=1, help='Repeticiones (se reporta la mejor)')
+    parser.add_argument('--no-memory', action='store_false', dest='memory',
+                       help='No medir memoria pico (evita la pasada con tracemalloc)')
+    parser.add_argument('--output', help='Archivo JSON de salida (por defecto: stdout)')
+
+    args = parser.parse_args()
+
+    report = run_benchmarks(args)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+import os
+import sys
+import stat
+import time
+import errno
+import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Tamaño de bloque para hashear al verificar
+HASH_CHUNK_SIZE = 1024 * 1024
+# Máximo que se pide al kernel en cada llamada de copia
+COPY_CHUNK_SIZE = 1 << 30
+# Errores con los que copy_file_range no aplica y se prueba otra vía
+COPY_FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EPERM}
+
+def file_digest(path):
+    """BLAKE2b de 128 bits del contenido de un archivo"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def kernel_copy(fsrc, fdst):
+    """
+    Copia el contenido de fsrc en fdst sin pasar por el espacio de usuario:
+    copy_file_range (que además aprovecha reflinks del sistema de archivos),
+    después sendfile y como último recurso una copia por bloques.
+    """
+    in_fd, out_fd = fsrc.fileno(), fdst.fileno()
+    copied = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while True:
+                n = os.copy_file_range(in_fd, out_fd, COPY_CHUNK_SIZE)
+                if n == 0:
+                    return
+                copied += n
+        except OSError as e:
+            if copied or e.errno not in COPY_FALLBACK_ERRNOS:
+                raise
+    if hasattr(os, 'sendfile'):
+        try:
+            while True:
+                n = os.sendfile(out_fd, in_fd, copied, COPY_CHUNK_SIZE)
+                if n == 0:
+                    return
+                copied += n
+        except OSError as e:
+            if copied or e.errno not in COPY_FALLBACK_ERRNOS:
+                raise
+    shutil.copyfileobj(fsrc, fdst)
+
+def copy_file(src, dst, timestamp_ns, verify_hash=True):
+    """Copia un archivo, le pone la fecha indicada y verifica tamaño (y hash); devuelve bytes"""
+    st = os.stat(src)
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        kernel_copy(fsrc, fdst)
+    os.chmod(dst, stat.S_IMODE(st.st_mode))
+    os.utime(dst, ns=(timestamp_ns, timestamp_ns))
+
+    size = os.stat(dst).st_size
+    if size != st.st_size:
+        raise OSError(f"tamaño distinto ({size} de {st.st_size} bytes)")
+    if verify_hash and file_digest(src) != file_digest(dst):
+        raise OSError("el hash de la copia no coincide")
+    return size
+
+def copy_tree(source, target, timestamp_ns, workers, verify_hash=True):
+    """
+    Replica source en target: crea los directorios, recrea los enlaces
+    simbólicos y copia los archivos en paralelo. Devuelve (archivos, bytes,
+    errores).
+    """
+    os.makedirs(target)
+    jobs = []
+    for dirpath, dirnames, filenames in os.walk(source):
+        rel_dir = os.path.relpath(dirpath, source)
+        target_dir = os.path.normpath(os.path.join(target, rel_dir))
+        for name in list(dirnames):
+            src = os.path.join(dirpath, name)
+            if os.path.islink(src):
+                # os.walk no desciende por enlaces: se recrean tal cual
+                os.symlink(os.readlink(src), os.path.join(target_dir, name))
+                dirnames.remove(name)
+            else:
+                os.mkdir(os.path.join(target_dir, name))
+        for name in filenames:
+            src = os.path.join(dirpath, name)
+            dst = os.path.join(target_dir, name)
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dst)
+            else:
+                jobs.append((src, dst))
+
+    errors = []
+    total_bytes = 0
+
+    def run(job):
+        src, dst = job
+        try:
+            return copy_file(src, dst, timestamp_ns, verify_hash)
+        except OSError as e:
+            errors.append(f"{src}: {str(e)}")
+            return 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for size in executor.map(run, jobs):
+            total_bytes += size
+    return len(jobs), total_bytes, errors
+
+def touch_tree(root, timestamp_ns, workers):
+    """Actualiza en el sitio la fecha de todos los archivos; devuelve (archivos, errores)"""
+    paths = [os.path.join(dirpath, name)
+             for dirpath, _, filenames in os.walk(root) for name in filenames]
+    errors = []
+
+    def run(path):
+        try:
+            os.utime(path, ns=(timestamp_ns, timestamp_ns), follow_symlinks=False)
+        except (OSError, NotImplementedError) as e:
+            errors.append(f"{path}: {str(e)}")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(run, paths))
+    return len(paths), errors
+
+def clean_dates(source, workers=None, touch_only=False, verify_hash=True, keep_original=False):
+    """
+    Deja todos los archivos de source con la fecha actual.
+    - touch_only cambia las fechas en el sitio, sin copiar nada
+    - si no, copia source en source_copia con la fecha ya aplicada, verifica
+      cada archivo (tamaño y, con verify_hash, hash), borra el original y
+      renombra la copia; con keep_original se conserva el original y la
+      copia queda en source_copia
+    Devuelve True si terminó sin errores.
+    """
+    source = os.path.normpath(source)
+    if not os.path.isdir(source):
+        print(f"Error: La carpeta de origen '{source}' no existe.")
+        return False
+    workers = workers or min(32, (os.cpu_count() or 1) * 4)
+    timestamp_ns = time.time_ns()
+    start = time.perf_counter()
+
+    if touch_only:
+        count, errors = touch_tree(source, timestamp_ns, workers)
+        for error in errors:
+            print(f"¡Error! {error}")
+        print(f"Fechas actualizadas en {count - len(errors)} de {count} archivos "
+              f"({time.perf_counter() - start:.1f} s).")
+        return not errors
+
+    target = source + "_copia"
+    if os.path.lexists(target):
+        print(f"¡Error! Ya existe '{target}'. No se modificó nada.")
+        return False
+
+    try:
+        count, total_bytes, errors = copy_tree(source, target, timestamp_ns, workers, verify_hash)
+    except OSError as e:
+        errors = [str(e)]
+        count = total_bytes = 0
+    if errors:
+        for error in errors:
+            print(f"¡Error al copiar! {error}")
+        print("No se borrará la carpeta original; se elimina la copia incompleta.")
+        shutil.rmtree(target, ignore_errors=True)
+        return False
+    check = "tamaño y hash" if verify_hash else "tamaño"
+    print(f"Copia completada en '{target}': {count} archivos, {total_bytes / 2**20:.1f} MB "
+          f"verificados por {check} ({time.perf_counter() - start:.1f} s).")
+
+    if keep_original:
+        return True
+
+    try:
+        shutil.rmtree(source)
+        print("Carpeta original eliminada.")
+    except OSError as e:
+        print(f"¡Error al borrar la original! La copia se mantiene en '{target}': {str(e)}")
+        return False
+
+    try:
+        os.rename(target, source)
+    except OSError as e:
+        print(f"¡Error! No se pudo renombrar: {str(e)}. La copia está en '{target}'.")
+        return False
+    print(f"¡Proceso completado! Carpeta renombrada a '{source}'.")
+    return True
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Renueva las fechas de todos los archivos de una carpeta (sustituye a date_cleaner.ps1)')
+    parser.add_argument('ruta_origen', help='Carpeta a procesar')
+    parser.add_argument('--workers', type=int, default=0,
+                       help='Hilos de copia en paralelo (0 = automático)')
+    parser.add_argument('--touch', action='store_true', dest='touch_only',
+                       help='Solo actualizar las fechas en el sitio, sin copiar')
+    parser.add_argument('--no-hash', action='store_false', dest='verify_hash',
+                       help='Verificar la copia solo por tamaño')
+    parser.add_argument('--keep-original', action='store_true',
+                       help='No borrar el original; la copia queda en <ruta>_copia')
+
+    args = parser.parse_args()
+
+    ok = clean_dates(args.ruta_origen, workers=args.workers, touch_only=args.touch_only,
+                     verify_hash=args.verify_hash, keep_original=args.keep_original)
+    if not ok:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
+
+# Ejemplo de uso:
+# python date_cleaner.py /ruta/a/la/carpeta
+# python date_cleaner.py /ruta/a/la/carpeta --touch
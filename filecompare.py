@@ -1,16 +1,491 @@
+import io
+import csv
 import os
+import re
+import html
+import stat
+import time
+import bisect
+import json
+import hashlib
+import shutil
+import tempfile
+import cProfile
+import pstats
+import tracemalloc
+from collections import deque, OrderedDict
+from contextlib import contextmanager, redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from difflib import Differ, SequenceMatcher
+from fnmatch import fnmatch
+from itertools import islice
+from functools import lru_cache
 from PIL import Image, ImageDraw, ImageFont
 
+# Directorio (dentro de output_dir) donde se guardan manifiestos y cachés
+STATE_DIRNAME = '.filecompare'
+HASH_CHUNK_SIZE = 1 << 20
+# Archivos modificados hace menos de esto no se guardan en el manifiesto:
+# su mtime todavía podría coincidir con una escritura posterior
+MANIFEST_RACY_NS = 2 * 10**9
+# Directorios que se podan por defecto en modo recursivo
+DEFAULT_EXCLUDES = ('.git/', 'bin/', 'obj/')
+# Ventana (en líneas) del modo streaming y tamaño máximo al que puede crecer
+STREAM_WINDOW = 20000
+STREAM_MAX_WINDOW = 160000
+# Caché de resultados: tamaño máximo, versión del formato (cambiarla invalida
+# las entradas previas) y opciones que forman parte de la clave
+RESULT_CACHE_MAX_BYTES = 1 << 30
+RESULT_CACHE_VERSION = 1
+RESULT_CACHE_SETTINGS = ('context_lines', 'max_gap', 'split_images', 'max_height',
+                         'highlight_partial', 'diff_engine', 'renderer', 'streaming',
+                         'png_palette', 'png_compress_level', 'png_optimize', 'max_width',
+                         'wide_lines')
+# Comparación canónica de SQL: extensiones a las que se aplica y versión de
+# las formas guardadas (cambiarla al cambiar las reglas las invalida)
+SQL_CANONICAL_EXTENSIONS = ('.sql',)
+SQL_CANONICAL_VERSION = 3
+# Similitud mínima (Jaccard estimado de pares de líneas) para emparejar un
+# archivo nuevo con uno desaparecido como renombrado
+RENAME_THRESHOLD = 0.5
+# Valores MinHash por firma y valores por banda del índice LSH
+SIGNATURE_SIZE = 64
+LSH_BAND_ROWS = 2
+# Archivos más lentos que se listan en el reporte de ejecución
+REPORT_TOP_FILES = 20
+# Máximo de máscaras de texto que conserva el caché de renderizado
+ROW_CACHE_SIZE = 4096
+# Codificación PNG: nivel de zlib por defecto, tonos de antialias por pareja
+# fondo/texto en la paleta y tratamiento de las líneas que superan max_width
+PNG_COMPRESS_LEVEL = 6
+PALETTE_LEVELS = 16
+# Para Image.point: píxeles con algo de tinta en una máscara de texto
+TEXT_COVERAGE_LUT = [0] + [255] * 255
+WIDE_LINE_MODES = ('wrap', 'tile')
+# Resaltado intralínea (highlight_partial): 0 desactivado, por palabras o
+# por caracteres. Solo se resaltan pares de líneas con longitudes parecidas
+# y una similitud mínima; los resultados por par se guardan en un LRU
+HIGHLIGHT_WORDS = 1
+HIGHLIGHT_CHARS = 2
+HIGHLIGHT_MODES = {'word': HIGHLIGHT_WORDS, 'char': HIGHLIGHT_CHARS}
+HIGHLIGHT_MIN_RATIO = 0.5
+HIGHLIGHT_LENGTH_RATIO = 0.4
+HIGHLIGHT_CACHE_SIZE = 8192
+
+# Estilos por tipo de línea: (fondo, texto, prefijo, número de línea)
+LINE_STYLES = {
+    'del': ((70, 30, 30), (255, 180, 180), '- ', (255, 150, 150)),
+    'add': ((30, 70, 30), (180, 255, 180), '+ ', (150, 255, 150)),
+    'ctx': ((45, 45, 45), (200, 200, 200), '  ', (150, 150, 150)),
+    # Archivos nuevos: fondo verde oscuro y texto verde claro
+    'new': ((20, 50, 20), (150, 255, 150), '+ ', (100, 255, 100)),
+}
+# Fondo de los fragmentos cambiados dentro de una línea (highlight_partial)
+HIGHLIGHT_COLORS = {
+    'del': (130, 45, 45),
+    'add': (45, 115, 45),
+}
+BACKGROUND_COLOR = (30, 30, 30)
+SEPARATOR_COLOR = (80, 80, 80)
+
+# Geometría de las imágenes (píxeles)
+LINE_HEIGHT = 20
+CHAR_WIDTH = 8
+MARGIN = 10
+GUTTER_WIDTH = 60
+
+def line_style(line_type, is_new_file=False):
+    """Estilo (fondo, texto, prefijo, número) de una línea a mostrar"""
+    if is_new_file:
+        return LINE_STYLES['new']
+    return LINE_STYLES.get(line_type, LINE_STYLES['ctx'])
+
+def file_digest(path):
+    """Calcula un hash rápido (BLAKE2b de 128 bits) del contenido de un archivo"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class FileManifest:
+    """Manifiesto persistente (ruta, tamaño, mtime, hash) de un directorio"""
+
+    def __init__(self, directory, state_dir):
+        self.directory = os.path.abspath(directory)
+        key = hashlib.blake2b(self.directory.encode('utf-8'), digest_size=8).hexdigest()
+        self.path = os.path.join(state_dir, f"manifest_{key}.json")
+        self.entries = {}
+        self.dirty = False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('directory') == self.directory:
+                self.entries = data.get('files', {})
+        except (OSError, ValueError):
+            pass
+
+    def digest(self, rel_path, st):
+        """Devuelve el hash del archivo, recalculándolo solo si cambió su stat"""
+        entry = self.entries.get(rel_path)
+        if entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            return entry[2]
+
+        digest = file_digest(os.path.join(self.directory, rel_path))
+        if time.time_ns() - st.st_mtime_ns > MANIFEST_RACY_NS:
+            self.entries[rel_path] = [st.st_size, st.st_mtime_ns, digest]
+            self.dirty = True
+        return digest
+
+    def save(self):
+        """Escribe el manifiesto de forma atómica si hubo cambios"""
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'directory': self.directory, 'files': self.entries}, f)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+class SqlCanonicalCache:
+    """
+    Hash de la forma canónica (sql_normalizer.canonical_sql) de cada script,
+    indexado por el hash de su contenido y guardado en state_dir: un .sql ya
+    visto no se vuelve a normalizar. Solo se conservan las entradas usadas en
+    la última ejecución.
+    """
+
+    def __init__(self, state_dir):
+        self.path = os.path.join(state_dir, 'sql_canonical.json')
+        self.entries = {}
+        self.used = set()
+        self.dirty = False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == SQL_CANONICAL_VERSION:
+                self.entries = data.get('files', {})
+        except (OSError, ValueError):
+            pass
+
+    def digest(self, path, content_digest, read=None):
+        """
+        Hash de la forma canónica del archivo, normalizándolo solo si no se
+        conoce; read() devuelve el texto cuando no está en disco (blobs de git).
+        """
+        self.used.add(content_digest)
+        canonical = self.entries.get(content_digest)
+        if canonical is None:
+            import sql_normalizer
+            if read is None:
+                with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+                    text = f.read()
+            else:
+                text = read()
+            text = sql_normalizer.canonical_sql(text)
+            canonical = hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+            self.entries[content_digest] = canonical
+            self.dirty = True
+        return canonical
+
+    def save(self):
+        """Escribe las entradas usadas de forma atómica si hubo cambios"""
+        if not self.dirty and self.used == set(self.entries):
+            return
+        entries = {key: self.entries[key] for key in self.used if key in self.entries}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': SQL_CANONICAL_VERSION, 'files': entries}, f)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+class ResultCache:
+    """
+    Caché en disco direccionada por contenido: para cada (hash de file1,
+    hash de file2, opciones de diff y renderizado) guarda copia de los
+    archivos generados. Un resultado vacío (sin cambios) también se guarda.
+    """
+
+    def __init__(self, cache_dir, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def key(self, digest1, digest2, options):
+        settings = {name: options[name] for name in RESULT_CACHE_SETTINGS}
+        payload = json.dumps([RESULT_CACHE_VERSION, digest1, digest2, settings], sort_keys=True)
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def restore(self, key, output_path):
+        """Copia los archivos de la entrada junto a output_path; None si no existe"""
+        entry_dir = self._entry_dir(key)
+        meta_path = os.path.join(entry_dir, 'meta.json')
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                suffixes = json.load(f)['files']
+        except (OSError, ValueError, KeyError):
+            return None
+
+        stem = os.path.splitext(output_path)[0]
+        restored = []
+        for idx, suffix in enumerate(suffixes):
+            target = stem + suffix
+            os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+            shutil.copyfile(os.path.join(entry_dir, str(idx)), target)
+            restored.append(target)
+        # El mtime de meta.json marca el último uso para la expulsión LRU
+        os.utime(meta_path)
+        return restored
+
+    def store(self, key, output_path, generated):
+        """Guarda lo generado; las rutas se registran relativas a output_path"""
+        entry_dir = self._entry_dir(key)
+        if os.path.isdir(entry_dir):
+            return
+        stem = os.path.splitext(output_path)[0]
+        if any(not path.startswith(stem) for path in generated):
+            return
+
+        os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp_', dir=os.path.dirname(entry_dir))
+        try:
+            for idx, path in enumerate(generated):
+                shutil.copyfile(path, os.path.join(tmp_dir, str(idx)))
+            with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump({'files': [path[len(stem):] for path in generated]}, f)
+            # Publicación atómica: otro proceso pudo guardar la misma clave
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _entries(self):
+        """(último uso, tamaño, directorio) de cada entrada"""
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for bucket in os.scandir(self.cache_dir):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                if entry.name.startswith('.tmp_'):
+                    continue
+                try:
+                    files = list(os.scandir(entry.path))
+                    last_used = os.stat(os.path.join(entry.path, 'meta.json')).st_mtime
+                    size = sum(f.stat().st_size for f in files)
+                except OSError:
+                    last_used, size = 0, 0
+                entries.append((last_used, size, entry.path))
+        return entries
+
+    def evict(self):
+        """Elimina las entradas menos usadas hasta quedar por debajo de max_bytes"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+
+    def clear(self):
+        """Invalida todo el caché"""
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+class FileStats:
+    """Tiempos por fase (segundos) y contadores de un archivo procesado"""
+
+    def __init__(self, label):
+        self.label = label
+        self.phases = {}
+        self.counters = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def total(self):
+        return self.phases.get('total', sum(self.phases.values()))
+
+class _NullStats:
+    """Sustituto sin coste cuando no se instrumenta"""
+
+    @contextmanager
+    def phase(self, name):
+        yield
+
+    def count(self, name, amount=1):
+        pass
+
+NULL_STATS = _NullStats()
+
+class RunReport:
+    """Acumula las métricas de una ejecución y las escribe en JSON o CSV"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.files = []
+        self.cosmetic = []
+        self.run = FileStats('ejecucion')
+
+    def add(self, stats):
+        self.files.append(stats)
+
+    def summary(self, top=REPORT_TOP_FILES):
+        phases, counters = {}, {}
+        for stats in self.files:
+            for name, value in stats.phases.items():
+                phases[name] = phases.get(name, 0.0) + value
+            for name, value in stats.counters.items():
+                counters[name] = counters.get(name, 0) + value
+        slowest = sorted(self.files, key=FileStats.total, reverse=True)[:top]
+        return {
+            'segundos': time.perf_counter() - self.started,
+            'archivos': len(self.files),
+            'ejecucion': {'fases': self.run.phases, 'contadores': self.run.counters},
+            'fases': phases,
+            'contadores': counters,
+            'mas_lentos': [{'archivo': stats.label, 'segundos': stats.total(),
+                            'fases': stats.phases, 'contadores': stats.counters}
+                           for stats in slowest],
+            'cosmeticos': self.cosmetic,
+        }
+
+    def write(self, path, top=REPORT_TOP_FILES):
+        """Escribe el reporte; con extensión .csv una fila por archivo, del más lento al más rápido"""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if not path.lower().endswith('.csv'):
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(self.summary(top), f, indent=2, ensure_ascii=False)
+            return
+
+        phase_names = sorted({name for stats in self.files for name in stats.phases})
+        counter_names = sorted({name for stats in self.files for name in stats.counters})
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['archivo', 'segundos'] + phase_names + counter_names)
+            for stats in sorted(self.files, key=FileStats.total, reverse=True):
+                writer.writerow([stats.label, f"{stats.total():.6f}"] +
+                                [f"{stats.phases.get(name, 0.0):.6f}" for name in phase_names] +
+                                [stats.counters.get(name, 0) for name in counter_names])
+
+def _instrumented_task(func, label, args):
+    """Ejecuta una tarea por archivo midiendo sus fases; devuelve (rutas, métricas)"""
+    stats = FileStats(label)
+    with stats.phase('total'):
+        generated = func(*args, stats=stats)
+    return generated, stats
+
+def make_options(context_lines=2, max_gap=5, split_images=0, max_height=1000,
+                 highlight_partial=0, diff_engine='myers', verify_engine=False,
+                 renderer='png', streaming=False, result_cache=None, png_palette=True,
+                 png_compress_level=PNG_COMPRESS_LEVEL, png_optimize=False, max_width=0,
+                 wide_lines='wrap', encode_threads=1):
+    """Opciones por archivo que reciben compare_file_pair y render_new_file"""
+    if wide_lines not in WIDE_LINE_MODES:
+        raise ValueError(f"Modo de líneas anchas desconocido: {wide_lines}")
+    if streaming and diff_engine == 'differ':
+        raise ValueError("El modo streaming no admite el motor 'differ' (use myers o patience)")
+    return {
+        'context_lines': context_lines,
+        'max_gap': max_gap,
+        'split_images': split_images,
+        'max_height': max_height,
+        'highlight_partial': highlight_partial,
+        'diff_engine': diff_engine,
+        'verify_engine': verify_engine,
+        'renderer': renderer,
+        'streaming': streaming,
+        'result_cache': result_cache,
+        'png_palette': png_palette,
+        'png_compress_level': png_compress_level,
+        'png_optimize': png_optimize,
+        'max_width': max_width,
+        'wide_lines': wide_lines,
+        'encode_threads': encode_threads,
+    }
+
 def compare_directories(dir1, dir2, output_dir, context_lines=2, max_gap=5, 
                        split_images=0, max_height=1000, highlight_partial=0,
-                       file_extensions=None):
+                       file_extensions=None, prefilter=True, state_dir=None,
+                       diff_engine='myers', verify_engine=False, workers=1,
+                       recursive=False, exclude=None, renderer='png', streaming=False,
+                       result_cache=True, cache_max_bytes=RESULT_CACHE_MAX_BYTES,
+                       clear_cache=False, report_path=None, profile=None,
+                       detect_renames=True, rename_threshold=RENAME_THRESHOLD,
+                       png_palette=True, png_compress_level=PNG_COMPRESS_LEVEL,
+                       png_optimize=False, max_width=0, wide_lines='wrap', encode_threads=1,
+                       sql_canonical=False, outputs=None):
     """
     Compara directorios mostrando SOLO diferencias reales:
     - Omite líneas vacías en la comparación
     - No genera imágenes para archivos sin cambios
     - Archivos nuevos siguen mostrándose completos
+    - Con prefilter, descarta archivos idénticos por tamaño y hash antes de
+      diferenciarlos; los hashes se guardan en un manifiesto en state_dir
+      (por defecto output_dir/.filecompare) para no recalcularlos
+    - diff_engine elige el motor de diferencias ('myers', 'patience' o el
+      'differ' original); con verify_engine se contrastan los hunks con Differ
+    - Con workers > 1 cada archivo se procesa en un pool de procesos; la
+      salida por consola se emite en el mismo orden que en modo secuencial
+    - Con recursive se recorren subdirectorios (podando los que coincidan con
+      exclude, patrones estilo .gitignore; por defecto bin/obj/.git) y las
+      imágenes replican la ruta relativa dentro de output_dir
+    - renderer elige el formato de salida: 'png' (evidencia, por defecto),
+      'html', 'svg' o 'unified' (texto diff)
+    - streaming lee y diferencia los archivos por ventanas (con myers o
+      patience; 'differ' no se admite) y, con PNG y split_images, vuelca cada
+      imagen al llenarse, así la memoria queda acotada sea cual sea el tamaño
+      del archivo; sin split_images las filas se acumulan en una sola imagen
+    - result_cache guarda lo generado por cada par (hash1, hash2, opciones) en
+      state_dir/results y lo reutiliza sin diferenciar ni renderizar; el caché
+      se recorta a cache_max_bytes y clear_cache lo vacía antes de empezar
+    - report_path escribe al final un reporte JSON (o CSV si termina en .csv)
+      con tiempos por fase y contadores por archivo, empezando por los más
+      lentos; profile ('cprofile' o 'tracemalloc') perfila el proceso
+      principal y guarda el resultado junto al reporte (o en state_dir)
+    - Con detect_renames los archivos nuevos se emparejan con los que
+      desaparecieron de dir1 si su similitud (MinHash + LSH) supera
+      rename_threshold, y se diferencian en vez de mostrarse completos
+    - Los PNG se dibujan en modo paleta (png_palette) y se guardan con
+      png_compress_level/png_optimize; con max_width > 0 las líneas más
+      anchas se parten en filas de continuación (wide_lines='wrap') o la
+      imagen se corta en franjas _c2, _c3... ('tile'); encode_threads
+      codifica páginas y franjas en paralelo
+    - highlight_partial (HIGHLIGHT_WORDS o HIGHLIGHT_CHARS) resalta en PNG,
+      HTML y SVG los fragmentos cambiados de cada línea frente a su homóloga
+      del mismo bloque de cambios
+    - Con sql_canonical los .sql que solo difieren en lo que corrige
+      SQLNormalizer (INNER, NOLOCK), mayúsculas o espacios se omiten sin
+      diferenciarlos y se listan aparte al final (y en el reporte); la forma
+      canónica se guarda por hash de contenido en state_dir
+    - outputs (dict) recibe las rutas generadas por cada archivo procesado,
+      indexadas por su ruta relativa
+    Devuelve la lista de imágenes generadas.
     """
+    if diff_engine not in DIFF_ENGINES:
+        raise ValueError(f"Motor de diferencias desconocido: {diff_engine}")
+    if profile not in PROFILERS:
+        raise ValueError(f"Perfilador desconocido: {profile}")
+    if renderer not in RENDERERS:
+        raise ValueError(f"Formato de salida desconocido: {renderer}")
+    extension = RENDERERS[renderer][0]
+
     # Validación y configuración inicial (igual que antes)
     for dir_path in [dir1, dir2]:
         if not os.path.isdir(dir_path):
@@ -20,142 +495,771 @@ def compare_directories(dir1, dir2, output_dir, context_lines=2, max_gap=5,
     dir2 = os.path.normpath(dir2)
     output_dir = os.path.normpath(output_dir)
     os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
 
     if file_extensions:
         file_extensions = [ext.lower() if ext.startswith('.') else f".{ext.lower()}" 
                          for ext in file_extensions]
         print(f"\nProcesando solo archivos con extensiones: {', '.join(file_extensions)}")
 
+    if exclude is None:
+        exclude = DEFAULT_EXCLUDES if recursive else ()
+
     def get_valid_files(directory):
-        return {f for f in os.listdir(directory) 
-                if os.path.isfile(os.path.join(directory, f)) and
-                (not file_extensions or 
-                 os.path.splitext(f)[1].lower() in file_extensions)}
-    
-    files_dir1 = get_valid_files(dir1)
-    files_dir2 = get_valid_files(dir2)
+        return walk_files(directory, recursive=recursive, exclude=exclude,
+                          file_extensions=file_extensions)
 
-    # Procesar archivos comunes
-    for filename in sorted(files_dir1 & files_dir2):
-        try:
-            file1_path = os.path.join(dir1, filename)
+    state_dir = os.path.normpath(state_dir or os.path.join(output_dir, STATE_DIRNAME))
+    use_manifest = prefilter or result_cache or sql_canonical
+    if use_manifest:
+        manifest1 = FileManifest(dir1, state_dir)
+        manifest2 = FileManifest(dir2, state_dir)
+    canonical = SqlCanonicalCache(state_dir) if sql_canonical else None
+
+    cache = None
+    if result_cache or clear_cache:
+        cache = ResultCache(os.path.join(state_dir, 'results'), cache_max_bytes)
+        if clear_cache:
+            cache.clear()
+            print(f"\nCaché de resultados vaciada: {cache.cache_dir}")
+        if not result_cache:
+            cache = None
+
+    options = make_options(context_lines, max_gap, split_images, max_height, highlight_partial,
+                           diff_engine, verify_engine, renderer, streaming, cache,
+                           png_palette, png_compress_level, png_optimize, max_width,
+                           wide_lines, encode_threads)
+
+    report = RunReport()
+    removed = {}   # archivos de dir1 sin pareja en dir2: candidatos a renombrado
+
+    def cosmetic_only(name1, path1, stat1, name2, path2, stat2):
+        """True si dos .sql son iguales tras canonicalizarlos"""
+        if canonical is None or os.path.splitext(name2)[1].lower() not in SQL_CANONICAL_EXTENSIONS:
+            return False
+        with report.run.phase('canonico'):
+            equal = (canonical.digest(path1, manifest1.digest(name1, stat1)) ==
+                     canonical.digest(path2, manifest2.digest(name2, stat2)))
+        if equal:
+            report.run.count('cosmeticos')
+            report.cosmetic.append(name2)
+        return equal
+
+    def common_tasks():
+        # Se recorre dir1 en streaming y se busca cada archivo en dir2
+        for filename, entry in get_valid_files(dir1):
+            file1_path = entry.path
             file2_path = os.path.join(dir2, filename)
-            
-            print(f"\nAnalizando: {filename}")
-            
-            # Leer archivos omitiendo líneas vacías
-            with open(file1_path, 'r', encoding='utf-8', errors='ignore') as f1:
-                file1_lines = [line.rstrip('\n') for line in f1 if line.strip()]
-            
-            with open(file2_path, 'r', encoding='utf-8', errors='ignore') as f2:
-                file2_lines = [line.rstrip('\n') for line in f2 if line.strip()]
-            
-            # Procesar diferencias
-            differ = Differ()
-            diff = [line for line in differ.compare(file1_lines, file2_lines) 
-                   if not line.startswith('  ') or line[2:].strip()]
-            
-            if not diff:
-                print(f"  Sin diferencias detectadas - omitiendo")
+            try:
+                stat2 = os.stat(file2_path)
+            except OSError:
+                if detect_renames:
+                    removed[filename] = file1_path
                 continue
-                
-            lines_to_show = process_diff(diff, file1_lines, file2_lines, context_lines, max_gap)
-            
-            if not lines_to_show:
-                print(f"  Sin cambios importantes - omitiendo")
+            if not stat.S_ISREG(stat2.st_mode):
                 continue
-                
-            # Generar imágenes solo si hay diferencias
-            generate_comparison_images(
-                lines_to_show=lines_to_show,
-                output_path=os.path.join(output_dir, f"{os.path.splitext(filename)[0]}.png"),
-                split_images=split_images,
-                max_height=max_height,
-                highlight_partial=highlight_partial,
-                is_new_file=False
-            )
+            message = f"\nAnalizando: {filename}"
             
-        except Exception as e:
-            print(f"Error procesando {filename}: {str(e)}")
+            # Prefiltro: mismo tamaño y mismo hash implica archivos idénticos
+            cache_key = None
+            try:
+                stat1 = entry.stat()
+                with report.run.phase('prefiltro'):
+                    identical = (prefilter and stat1.st_size == stat2.st_size and
+                                 manifest1.digest(filename, stat1) == manifest2.digest(filename, stat2))
+                if identical:
+                    report.run.count('identicos')
+                    yield f"{message}\n  Archivos idénticos - omitiendo", None, None
+                    continue
+                if cosmetic_only(filename, file1_path, stat1, filename, file2_path, stat2):
+                    yield f"{message}\n  Solo cambios cosméticos SQL - omitiendo", None, None
+                    continue
+                if cache is not None:
+                    with report.run.phase('prefiltro'):
+                        cache_key = cache.key(manifest1.digest(filename, stat1),
+                                              manifest2.digest(filename, stat2), options)
+            except OSError as e:
+                yield f"{message}\nError procesando {filename}: {str(e)}", None, None
+                continue
 
-    # Procesar archivos nuevos (mostrar completos)
-    for filename in sorted(files_dir2 - files_dir1):
+            output_path = os.path.join(output_dir, f"{os.path.splitext(filename)[0]}{extension}")
+            yield message, _instrumented_task, (compare_file_pair, filename,
+                                                (file1_path, file2_path, output_path, filename,
+                                                 options, cache_key))
+
+    def save_manifests():
+        if use_manifest:
+            for manifest in (manifest1, manifest2) + ((canonical,) if canonical else ()):
+                try:
+                    manifest.save()
+                except OSError as e:
+                    print(f"Error guardando manifiesto {manifest.path}: {str(e)}")
+
+    def renamed_task(old_name, filename, entry, similarity):
+        message = f"\nAnalizando RENOMBRADO: {old_name} -> {filename} ({similarity:.0%} similar)"
+        report.run.count('renombrados')
+        file1_path = removed[old_name]
+        cache_key = None
         try:
-            file2_path = os.path.join(dir2, filename)
-            print(f"\nProcesando NUEVO archivo: {filename}")
-            
-            with open(file2_path, 'r', encoding='utf-8', errors='ignore') as f:
-                lines = [line.rstrip('\n') for line in f if line.strip()] or ["[ARCHIVO VACÍO]"]
-            
-            generate_comparison_images(
-                lines_to_show=[('new', i, line, None) for i, line in enumerate(lines)],
-                output_path=os.path.join(output_dir, f"{os.path.splitext(filename)[0]}_NUEVO.png"),
-                split_images=split_images,
-                max_height=max_height,
-                highlight_partial=False,
-                is_new_file=True
-            )
-            
+            if use_manifest:
+                digest1 = manifest1.digest(old_name, os.stat(file1_path))
+                digest2 = manifest2.digest(filename, entry.stat())
+                if prefilter and digest1 == digest2:
+                    return f"{message}\n  Archivo renombrado sin cambios - omitiendo", None, None
+                if cosmetic_only(old_name, file1_path, os.stat(file1_path),
+                                 filename, entry.path, entry.stat()):
+                    return (f"{message}\n  Renombrado con solo cambios cosméticos SQL - omitiendo",
+                            None, None)
+                if cache is not None:
+                    cache_key = cache.key(digest1, digest2, options)
+        except OSError as e:
+            return f"{message}\nError procesando {filename}: {str(e)}", None, None
+        output_path = os.path.join(output_dir, f"{os.path.splitext(filename)[0]}{extension}")
+        return message, _instrumented_task, (compare_file_pair, filename,
+                                             (file1_path, entry.path, output_path, filename,
+                                              options, cache_key))
+
+    def new_file_tasks():
+        added = [(filename, entry) for filename, entry in get_valid_files(dir2)
+                 if not os.path.isfile(os.path.join(dir1, filename))]
+        renames = {}
+        if removed and added:
+            with report.run.phase('renombrados'):
+                renames = match_renamed_files(removed, {filename: entry.path
+                                                        for filename, entry in added},
+                                              rename_threshold)
+
+        # Archivos nuevos (mostrar completos) salvo los renombrados
+        for filename, entry in added:
+            if filename in renames:
+                old_name, similarity = renames[filename]
+                yield renamed_task(old_name, filename, entry, similarity)
+                continue
+            output_path = os.path.join(output_dir, f"{os.path.splitext(filename)[0]}_NUEVO{extension}")
+            message = f"\nProcesando NUEVO archivo: {filename}"
+            cache_key = None
+            if cache is not None:
+                try:
+                    cache_key = cache.key(None, manifest2.digest(filename, entry.stat()), options)
+                except OSError as e:
+                    yield f"{message}\nError procesando nuevo archivo {filename}: {str(e)}", None, None
+                    continue
+            yield message, _instrumented_task, (render_new_file, filename,
+                                                (entry.path, output_path, filename, options,
+                                                 cache_key))
+
+    def all_tasks():
+        yield from common_tasks()
+        yield from new_file_tasks()
+        save_manifests()
+
+    generated = []
+    profiler = start_profiler(profile)
+    try:
+        for result in run_tasks(all_tasks(), workers):
+            # Un proceso de trabajo caído devuelve una lista vacía sin métricas
+            images, stats = result if isinstance(result, tuple) else (result, None)
+            generated.extend(images)
+            if stats is not None:
+                report.add(stats)
+                if outputs is not None:
+                    outputs[stats.label] = images
+    finally:
+        if profiler is not None:
+            profile_base = os.path.splitext(report_path)[0] if report_path else \
+                os.path.join(state_dir, 'perfil')
+            stop_profiler(profiler, profile_base)
+
+    if cache is not None:
+        try:
+            with report.run.phase('cache'):
+                cache.evict()
+        except OSError as e:
+            print(f"Error recortando caché {cache.cache_dir}: {str(e)}")
+
+    if report.cosmetic:
+        print(f"\nArchivos .sql con solo cambios cosméticos ({len(report.cosmetic)}):")
+        for filename in report.cosmetic:
+            print(f"  {filename}")
+
+    if report_path:
+        report.write(report_path)
+        print(f"\nReporte de ejecución: {report_path}")
+    return generated
+
+# Perfiladores opcionales del proceso principal
+PROFILERS = (None, 'cprofile', 'tracemalloc')
+
+def start_profiler(profile):
+    if profile == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+    if profile == 'tracemalloc':
+        tracemalloc.start()
+        return tracemalloc
+    return None
+
+def stop_profiler(profiler, base_path):
+    """
+    Detiene el perfilador y guarda base_path.prof (con su resumen en
+    base_path.prof.txt) o base_path.mem.txt
+    """
+    os.makedirs(os.path.dirname(base_path) or '.', exist_ok=True)
+    if profiler is tracemalloc:
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        path = base_path + '.mem.txt'
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f"Memoria pico: {peak / 2**20:.1f} MB\n")
+            for stat_line in snapshot.statistics('lineno')[:25]:
+                f.write(f"{stat_line}\n")
+    else:
+        profiler.disable()
+        path = base_path + '.prof'
+        profiler.dump_stats(path)
+        with open(path + '.txt', 'w', encoding='utf-8') as f:
+            pstats.Stats(profiler, stream=f).sort_stats('cumulative').print_stats(15)
+    print(f"\nPerfil guardado: {path}")
+
+def shingle_hash(previous, line):
+    """
+    Hash de 64 bits de un par de líneas consecutivas. Es BLAKE2b y no hash():
+    el de Python cambia con PYTHONHASHSEED y con él los renombrados detectados.
+
+    >>> shingle_hash('', 'SELECT 1')
+    1850467416234039801
+    """
+    data = f"{previous}\n{line}".encode('utf-8', errors='surrogatepass')
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+
+def file_signature(path, size=SIGNATURE_SIZE):
+    """
+    Firma MinHash de un archivo de texto sobre los pares de líneas no vacías
+    consecutivas, con una sola función hash repartida en size cubetas (one
+    permutation hashing) y cubetas vacías rellenadas por rotación. None si
+    el archivo no tiene líneas.
+    """
+    mask = (1 << 64) - 1
+    mins = [None] * size
+    previous = ''
+    for line in iter_lines(path):
+        line = line.strip()
+        value = shingle_hash(previous, line)
+        previous = line
+        bucket = value % size
+        if mins[bucket] is None or value < mins[bucket]:
+            mins[bucket] = value
+    if all(value is None for value in mins):
+        return None
+    signature = list(mins)
+    for i in range(size):
+        distance = 1
+        while signature[i] is None:
+            donor = mins[(i + distance) % size]
+            if donor is not None:
+                signature[i] = (donor + distance * 0x9E3779B97F4A7C15) & mask
+            distance += 1
+    return tuple(signature)
+
+def match_renamed_files(removed, added, threshold=RENAME_THRESHOLD):
+    """
+    Empareja archivos desaparecidos con archivos nuevos por similitud de
+    contenido. removed y added son {ruta relativa: ruta}; devuelve
+    {nueva: (anterior, similitud)}. Un índice LSH por bandas de la firma
+    limita las comparaciones a candidatos que comparten alguna banda, y la
+    asignación es voraz de mayor a menor similitud (cada archivo, una vez).
+    """
+    def signatures(files):
+        result = {}
+        for name, path in files.items():
+            try:
+                signature = file_signature(path)
+            except OSError:
+                continue
+            if signature is not None:
+                result[name] = signature
+        return result
+
+    old_signatures = signatures(removed)
+    if not old_signatures:
+        return {}
+    new_signatures = signatures(added)
+
+    buckets = {}
+    for name, signature in old_signatures.items():
+        for start in range(0, SIGNATURE_SIZE, LSH_BAND_ROWS):
+            buckets.setdefault((start, signature[start:start + LSH_BAND_ROWS]), []).append(name)
+
+    pairs = []
+    for new_name, signature in new_signatures.items():
+        candidates = set()
+        for start in range(0, SIGNATURE_SIZE, LSH_BAND_ROWS):
+            candidates.update(buckets.get((start, signature[start:start + LSH_BAND_ROWS]), ()))
+        for old_name in candidates:
+            old_signature = old_signatures[old_name]
+            similarity = sum(a == b for a, b in zip(signature, old_signature)) / SIGNATURE_SIZE
+            if similarity >= threshold:
+                pairs.append((-similarity, new_name, old_name))
+
+    renames = {}
+    used = set()
+    for negative_similarity, new_name, old_name in sorted(pairs):
+        if new_name not in renames and old_name not in used:
+            renames[new_name] = (old_name, -negative_similarity)
+            used.add(old_name)
+    return renames
+
+def walk_files(root, recursive=False, exclude=(), file_extensions=None):
+    """
+    Recorre un directorio con os.scandir produciendo (ruta relativa, DirEntry)
+    de los archivos válidos, en orden alfabético dentro de cada carpeta.
+    Los directorios excluidos se podan antes de descender.
+    """
+    pending = ['']
+    while pending:
+        rel_dir = pending.pop()
+        try:
+            with os.scandir(os.path.join(root, rel_dir)) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            print(f"Error leyendo directorio {os.path.join(root, rel_dir)}: {str(e)}")
+            continue
+
+        subdirs = []
+        for entry in entries:
+            rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+            # Los tipos vienen cacheados del dirent; no se hace stat adicional
+            if entry.is_dir(follow_symlinks=False):
+                if recursive and not is_excluded(rel_path, True, exclude):
+                    subdirs.append(rel_path)
+            elif (entry.is_file() and
+                  (not file_extensions or
+                   os.path.splitext(entry.name)[1].lower() in file_extensions) and
+                  not is_excluded(rel_path, False, exclude)):
+                yield rel_path, entry
+        pending.extend(reversed(subdirs))
+
+def is_excluded(rel_path, is_dir, patterns):
+    """
+    Evalúa patrones estilo .gitignore: 'nombre' o '*.ext' aplican en cualquier
+    nivel, 'a/b' y '/a' se anclan a la raíz y 'dir/' solo aplica a directorios.
+    """
+    rel_path = rel_path.replace(os.sep, '/')
+    name = rel_path.rsplit('/', 1)[-1]
+    for pattern in patterns:
+        if pattern.endswith('/'):
+            if not is_dir:
+                continue
+            pattern = pattern.rstrip('/')
+        if pattern.startswith('**/'):
+            pattern = pattern[3:]
+        if '/' in pattern:
+            if fnmatch(rel_path, pattern.lstrip('/')):
+                return True
+        elif fnmatch(name, pattern):
+            return True
+    return False
+
+def compare_file_pair(file1_path, file2_path, output_path, label, options, cache_key=None,
+                      stats=None):
+    """Diferencia un par de archivos y genera sus imágenes; devuelve sus rutas"""
+    try:
+        return _cached(options, cache_key, output_path, _diff_and_render,
+                       (file1_path, file2_path, output_path, options, stats or NULL_STATS))
+    except Exception as e:
+        print(f"Error procesando {label}: {str(e)}")
+        return []
+
+def render_new_file(file2_path, output_path, label, options, cache_key=None, stats=None):
+    """Genera las imágenes de un archivo nuevo mostrándolo completo"""
+    try:
+        return _cached(options, cache_key, output_path, _render_full,
+                       (file2_path, output_path, options, stats or NULL_STATS))
+    except Exception as e:
+        print(f"Error procesando nuevo archivo {label}: {str(e)}")
+        return []
+
+def compare_lines(file1_lines, file2_lines, output_path, label, options, cache_key=None,
+                  stats=None):
+    """
+    Como compare_file_pair con el contenido ya en memoria (listas de líneas
+    sin vacías, p. ej. blobs de git). El modo streaming no aplica.
+    """
+    try:
+        return _cached(options, cache_key, output_path, _diff_lines_and_render,
+                       (file1_lines, file2_lines, output_path, options, stats or NULL_STATS))
+    except Exception as e:
+        print(f"Error procesando {label}: {str(e)}")
+        return []
+
+def render_new_lines(lines, output_path, label, options, cache_key=None, stats=None):
+    """Como render_new_file con el contenido ya en memoria"""
+    try:
+        return _cached(options, cache_key, output_path, _render_lines,
+                       (lines, output_path, options, stats or NULL_STATS))
+    except Exception as e:
+        print(f"Error procesando nuevo archivo {label}: {str(e)}")
+        return []
+
+def _cached(options, cache_key, output_path, func, args):
+    """Reutiliza el resultado en caché o ejecuta func y guarda lo generado"""
+    cache = options.get('result_cache')
+    if cache is None or cache_key is None:
+        return func(*args)
+
+    stats = args[-1]
+    with stats.phase('cache'):
+        generated = cache.restore(cache_key, output_path)
+    if generated is not None:
+        stats.count('cache_hits')
+        if not generated:
+            print(f"  Sin cambios importantes (caché) - omitiendo")
+        for path in generated:
+            print(f"  Imagen reutilizada: {os.path.basename(path)}")
+        return generated
+
+    generated = func(*args)
+    cache.store(cache_key, output_path, generated)
+    return generated
+
+def _diff_and_render(file1_path, file2_path, output_path, options, stats):
+    if options['streaming']:
+        return _stream_file_pair(file1_path, file2_path, output_path, options, stats)
+
+    # Leer archivos omitiendo líneas vacías
+    with stats.phase('lectura'):
+        file1_lines = read_lines(file1_path)
+        file2_lines = read_lines(file2_path)
+    return _diff_lines_and_render(file1_lines, file2_lines, output_path, options, stats)
+
+def _diff_lines_and_render(file1_lines, file2_lines, output_path, options, stats):
+    stats.count('lineas', len(file1_lines) + len(file2_lines))
+    
+    if file1_lines == file2_lines:
+        print(f"  Sin diferencias detectadas - omitiendo")
+        return []
+        
+    with stats.phase('diff'):
+        changes = compute_changes(file1_lines, file2_lines, options['diff_engine'])
+    with stats.phase('agrupado'):
+        lines_to_show = group_changes(changes, file1_lines, file2_lines,
+                                      options['context_lines'], options['max_gap'])
+    stats.count('hunks', sum(1 for row in lines_to_show if row[0] == 'sep'))
+    stats.count('filas', len(lines_to_show))
+    
+    if options['verify_engine'] and options['diff_engine'] != 'differ':
+        mismatches = compare_engines(file1_lines, file2_lines, options['context_lines'],
+                                     options['max_gap'], algorithm=options['diff_engine'])
+        if mismatches:
+            print(f"  [verificación] {len(mismatches)} hunk(s) distintos a Differ:")
+            for mismatch in mismatches[:5]:
+                print(f"    {mismatch}")
+        else:
+            print(f"  [verificación] Hunks equivalentes a Differ")
+    
+    if not lines_to_show:
+        print(f"  Sin cambios importantes - omitiendo")
+        return []
+        
+    # Generar imágenes solo si hay diferencias
+    return _render(lines_to_show, output_path, options['highlight_partial'], False,
+                   options, stats)
+
+def _render_full(file2_path, output_path, options, stats):
+    if options['streaming']:
+        rows = (('new', i, line, None) for i, line in enumerate(iter_lines(file2_path)))
+        generated = _write_rows(rows, output_path, True, options, stats)
+        if not generated:
+            generated = _write_rows([('new', 0, "[ARCHIVO VACÍO]", None)], output_path,
+                                    True, options, stats)
+        return generated
+
+    with stats.phase('lectura'):
+        lines = read_lines(file2_path)
+    return _render_lines(lines, output_path, options, stats)
+
+def _render_lines(lines, output_path, options, stats):
+    lines = lines or ["[ARCHIVO VACÍO]"]
+    stats.count('lineas', len(lines))
+    stats.count('filas', len(lines))
+    
+    return _render([('new', i, line, None) for i, line in enumerate(lines)], output_path,
+                   False, True, options, stats)
+
+def _render(lines_to_show, output_path, highlight_partial, is_new_file, options, stats):
+    """Genera la salida con el backend elegido; PNG recibe además su codificador"""
+    extra = {'encoder': png_encoder(options)} if options['renderer'] == 'png' else {}
+    return RENDERERS[options['renderer']][1](
+        lines_to_show=lines_to_show,
+        output_path=output_path,
+        split_images=options['split_images'],
+        max_height=options['max_height'],
+        highlight_partial=highlight_partial,
+        is_new_file=is_new_file,
+        stats=stats,
+        **extra
+    )
+
+def _stream_file_pair(file1_path, file2_path, output_path, options, stats):
+    """Diferencia en modo streaming: sin cargar los archivos completos"""
+    rows = stream_hunks(iter_lines(file1_path), iter_lines(file2_path),
+                        options['context_lines'], options['max_gap'],
+                        algorithm=options['diff_engine'])
+    generated = _write_rows(rows, output_path, False, options, stats)
+    if not generated:
+        print(f"  Sin diferencias detectadas - omitiendo")
+    return generated
+
+def _write_rows(rows, output_path, is_new_file, options, stats):
+    """
+    Vuelca filas en streaming: PNG por páginas si se divide en imágenes; sin
+    split_images, o con otros formatos, se genera la salida completa
+    """
+    rows = _count_rows(rows, stats)
+    if options['renderer'] != 'png' or not options['split_images']:
+        return _render(list(rows), output_path,
+                       0 if is_new_file else options['highlight_partial'], is_new_file,
+                       options, stats)
+
+    writer = PagedImageWriter(output_path, options['max_height'], is_new_file, stats=stats,
+                              encoder=png_encoder(options),
+                              highlight_partial=0 if is_new_file else options['highlight_partial'])
+    for row in rows:
+        writer.add(row)
+    return writer.close()
+
+def _count_rows(rows, stats):
+    for row in rows:
+        stats.count('filas')
+        if row[0] == 'sep':
+            stats.count('hunks')
+        yield row
+
+def run_tasks(tasks, workers=1):
+    """
+    Ejecuta tareas (mensaje, función, args) y devuelve sus resultados en orden.
+    Con workers > 1 las funciones corren en un pool de procesos y su salida
+    por consola se captura para imprimirla tras el mensaje correspondiente.
+    Las tareas sin función solo imprimen su mensaje.
+    """
+    if workers <= 1:
+        for message, func, args in tasks:
+            print(message)
+            if func is not None:
+                yield func(*args)
+        return
+
+    def collect(message, future):
+        print(message)
+        if future is None:
+            return None
+        try:
+            output, result = future.result()
         except Exception as e:
-            print(f"Error procesando nuevo archivo {filename}: {str(e)}")
+            # Un proceso caído no debe detener el resto de archivos
+            print(f"Error en proceso de trabajo: {str(e)}")
+            return []
+        print(output, end='')
+        return result
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for message, func, args in tasks:
+            future = executor.submit(_captured_call, func, args) if func is not None else None
+            pending.append((message, future))
+            # Limitar las tareas en vuelo para no materializar todo el árbol
+            while len(pending) > workers * 4 or (pending and pending[0][1] is None):
+                result = collect(*pending.popleft())
+                if result is not None:
+                    yield result
+        while pending:
+            result = collect(*pending.popleft())
+            if result is not None:
+                yield result
+
+def _captured_call(func, args):
+    """Ejecuta func(*args) capturando su salida por consola"""
+    buffer = io.StringIO()
+    with redirect_stdout(buffer):
+        result = func(*args)
+    return buffer.getvalue(), result
+
+def read_lines(path):
+    """Lee un archivo de texto omitiendo líneas vacías"""
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        return [line.rstrip('\n') for line in f if line.strip()]
+
+def iter_lines(path):
+    """Lee un archivo perezosamente omitiendo líneas vacías"""
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            if line.strip():
+                yield line.rstrip('\n')
+
+def stream_hunks(file1_lines, file2_lines, context_lines, max_gap, algorithm='patience',
+                 window=STREAM_WINDOW):
+    """
+    Versión en streaming de build_hunks: consume dos iterables de líneas por
+    ventanas y produce las filas de lines_to_show a medida que se resuelven.
+    Cada ventana se corta en medio de un bloque de líneas coincidentes lo
+    bastante largo para que ningún hunk ni su contexto lo crucen, de modo
+    que la memoria depende del tamaño de ventana y no del archivo. Si no
+    hay punto de sincronización la ventana crece hasta STREAM_MAX_WINDOW.
+    """
+    if algorithm == 'differ':
+        raise ValueError("El modo streaming no admite el motor 'differ' (use myers o patience)")
+    iter1, iter2 = iter(file1_lines), iter(file2_lines)
+    buf1, buf2 = [], []
+    base1 = base2 = 0
+    eof1 = eof2 = False
+    min_sync = max(2 * context_lines + 2, max_gap + 2)
+    limit = window
+
+    while True:
+        if not eof1 and len(buf1) < limit:
+            chunk = list(islice(iter1, limit - len(buf1)))
+            eof1 = len(chunk) < limit - len(buf1)
+            buf1.extend(chunk)
+        if not eof2 and len(buf2) < limit:
+            chunk = list(islice(iter2, limit - len(buf2)))
+            eof2 = len(chunk) < limit - len(buf2)
+            buf2.extend(chunk)
+        if not buf1 and not buf2:
+            return
+
+        opcodes = diff_opcodes(buf1, buf2, algorithm)
+        if eof1 and eof2:
+            cut = (len(buf1), len(buf2))
+        else:
+            cut = _stream_sync_point(opcodes, min_sync)
+            if cut is None and limit < STREAM_MAX_WINDOW:
+                limit = min(limit * 2, STREAM_MAX_WINDOW)
+                continue
+            if cut is None:
+                # Sin sincronización posible: se corta al final del último bloque igual
+                equal = [op for op in opcodes if op[0] == 'equal']
+                cut = (equal[-1][2], equal[-1][4]) if equal else (len(buf1), len(buf2))
+            limit = window
+
+        cut1, cut2 = cut
+        segment = [op for op in opcodes if op[2] <= cut1 and op[4] <= cut2 and op[0] != 'equal']
+        seg1, seg2 = buf1[:cut1], buf2[:cut2]
+        changes = _opcodes_to_changes(segment, seg1, seg2)
+        for line_type, line_num, content, counterpart in group_changes(
+                changes, seg1, seg2, context_lines, max_gap):
+            if line_num is not None:
+                line_num += base2 if line_type == 'add' else base1
+            yield (line_type, line_num, content, counterpart)
+
+        del buf1[:cut1]
+        del buf2[:cut2]
+        base1 += cut1
+        base2 += cut2
+
+def _stream_sync_point(opcodes, min_sync):
+    """Punto de corte a mitad del último bloque igual de al menos min_sync líneas"""
+    for tag, i1, i2, j1, j2 in reversed(opcodes):
+        if tag == 'equal' and i2 - i1 >= min_sync:
+            half = (i2 - i1) // 2
+            return i1 + half, j1 + half
+    return None
 
 def process_diff(diff, file1_lines, file2_lines, context_lines, max_gap):
     """Procesa diferencias ignorando líneas vacías"""
+    return group_changes(differ_changes(diff), file1_lines, file2_lines, context_lines, max_gap)
+
+def differ_changes(diff):
+    """Cambios (tipo, línea, contenido, contraparte) a partir de la salida de Differ"""
     changes = []
     file1_pos = 0
     file2_pos = 0
+    block_start = 0
     
     for line in diff:
         if line.startswith('  '):
+            _pair_block(changes, block_start)
+            block_start = len(changes)
             file1_pos += 1
             file2_pos += 1
         elif line.startswith('- '):
-            changes.append(('del', file1_pos, line[2:], 
-                          file2_lines[file2_pos] if file2_pos < len(file2_lines) else ""))
+            changes.append(('del', file1_pos, line[2:], ""))
             file1_pos += 1
         elif line.startswith('+ '):
-            changes.append(('add', file2_pos, line[2:],
-                          file1_lines[file1_pos - 1] if file1_pos > 0 and (file1_pos - 1) < len(file1_lines) else ""))
+            changes.append(('add', file2_pos, line[2:], ""))
             file2_pos += 1
+    _pair_block(changes, block_start)
+    return changes
+
+def _pair_block(changes, start):
+    """
+    Empareja el k-ésimo borrado con la k-ésima alta de un mismo bloque de
+    cambios (entre dos líneas iguales), como _opcodes_to_changes: una alta
+    o un borrado sin pareja no tiene contraparte que resaltar.
+    """
+    dels = [k for k in range(start, len(changes)) if changes[k][0] == 'del']
+    adds = [k for k in range(start, len(changes)) if changes[k][0] == 'add']
+    for d, a in zip(dels, adds):
+        changes[d] = changes[d][:3] + (changes[a][2],)
+        changes[a] = changes[a][:3] + (changes[d][2],)
 
-    # Agrupar cambios cercanos
+def group_changes(changes, file1_lines, file2_lines, context_lines, max_gap):
+    """
+    Agrupa cambios cercanos y les añade líneas de contexto. Las posiciones
+    se llevan en file1: la de una alta se deduce de las líneas iguales que
+    la separan del cambio anterior, y el contexto (líneas iguales en ambos
+    archivos) se toma de file1 con su numeración, también entre los cambios
+    de un mismo grupo. Dos grupos cuyo contexto se solaparía se unen.
+    """
+    # Agrupar cambios cercanos: ([(cambio, línea de file1)], fin exclusivo)
     grouped_changes = []
     current_group = []
     last_pos = -max_gap - 1
+    file1_pos = file2_pos = 0
     
     for change in changes:
-        if change[1] - last_pos > max_gap:
+        if change[0] == 'del':
+            pos = change[1]
+            file2_pos += pos - file1_pos
+            file1_pos = pos + 1
+        else:
+            pos = file1_pos + change[1] - file2_pos
+            file1_pos = pos
+            file2_pos = change[1] + 1
+        if pos - last_pos > max_gap and (not current_group or
+                                         pos - group_end > 2 * context_lines):
             if current_group:
-                grouped_changes.append(current_group)
+                grouped_changes.append((current_group, group_end))
             current_group = []
-        current_group.append(change)
-        last_pos = change[1]
+        current_group.append((change, pos))
+        last_pos = pos
+        group_end = file1_pos
     
     if current_group:
-        grouped_changes.append(current_group)
+        grouped_changes.append((current_group, group_end))
     
     # Construir resultado con contexto
     lines_to_show = []
-    for group in grouped_changes:
-        first_line = group[0][1]
-        last_line = group[-1][1]
-        
+    for group, end_line in grouped_changes:
         # Contexto antes
+        first_line = group[0][1]
         start = max(0, first_line - context_lines)
         for i in range(start, first_line):
             lines_to_show.append(('ctx', i, file1_lines[i], None))
         
-        # Cambios
-        for change in group:
+        # Cambios, con las líneas iguales que quedan entre ellos
+        next_line = first_line
+        for change, pos in group:
+            for i in range(next_line, pos):
+                lines_to_show.append(('ctx', i, file1_lines[i], None))
             lines_to_show.append(change)
+            next_line = max(next_line, pos + 1 if change[0] == 'del' else pos)
         
         # Contexto después
-        end = min(last_line + context_lines + 1, max(len(file1_lines), len(file2_lines)))
-        for i in range(last_line + 1, end):
-            line_content = file1_lines[i] if i < len(file1_lines) else ''
-            if i < len(file2_lines) and line_content != file2_lines[i]:
-                line_content = file2_lines[i]
-            lines_to_show.append(('ctx', i, line_content, None))
+        end = min(end_line + context_lines, len(file1_lines))
+        for i in range(end_line, end):
+            lines_to_show.append(('ctx', i, file1_lines[i], None))
         
         # Separador
         if lines_to_show:  # Solo añadir si hay contenido
@@ -163,78 +1267,655 @@ def process_diff(diff, file1_lines, file2_lines, context_lines, max_gap):
     
     return lines_to_show
 
+# Motores de diferencias: 'differ' conserva el camino original basado en texto
+DIFF_ENGINES = ('myers', 'patience', 'differ')
+
+def build_hunks(file1_lines, file2_lines, context_lines, max_gap, algorithm='myers'):
+    """Calcula los hunks (lines_to_show) con el motor indicado"""
+    changes = compute_changes(file1_lines, file2_lines, algorithm)
+    return group_changes(changes, file1_lines, file2_lines, context_lines, max_gap)
+
+def compute_changes(file1_lines, file2_lines, algorithm='myers'):
+    """Cambios sin agrupar con el motor indicado (la parte cara de build_hunks)"""
+    if algorithm == 'differ':
+        diff = [line for line in Differ().compare(file1_lines, file2_lines)
+                if not line.startswith('  ') or line[2:].strip()]
+        return differ_changes(diff)
+    return diff_changes(file1_lines, file2_lines, algorithm)
+
+def diff_changes(file1_lines, file2_lines, algorithm='myers'):
+    """Genera los cambios (tipo, línea, contenido, contraparte) sin diff de texto"""
+    return _opcodes_to_changes(diff_opcodes(file1_lines, file2_lines, algorithm),
+                               file1_lines, file2_lines)
+
+def _opcodes_to_changes(opcodes, file1_lines, file2_lines):
+    changes = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            continue
+        # En bloques reemplazados cada línea se empareja con su homóloga
+        for i in range(i1, i2):
+            j = j1 + (i - i1)
+            changes.append(('del', i, file1_lines[i], file2_lines[j] if j < j2 else ""))
+        for j in range(j1, j2):
+            i = i1 + (j - j1)
+            changes.append(('add', j, file2_lines[j], file1_lines[i] if i < i2 else ""))
+    return changes
+
+def diff_opcodes(file1_lines, file2_lines, algorithm='myers'):
+    """Opcodes al estilo SequenceMatcher.get_opcodes usando Myers o patience"""
+    # Las líneas se codifican como enteros para comparar más rápido
+    ids = {}
+    a = [ids.setdefault(line, len(ids)) for line in file1_lines]
+    b = [ids.setdefault(line, len(ids)) for line in file2_lines]
+
+    blocks = []
+    if algorithm == 'patience':
+        _patience_blocks(a, b, 0, len(a), 0, len(b), blocks)
+    else:
+        _myers_blocks(a, b, 0, len(a), 0, len(b), blocks)
+    blocks.sort()
+
+    opcodes = []
+    i = j = 0
+    for block_i, block_j, size in _merge_blocks(blocks) + [(len(a), len(b), 0)]:
+        if i < block_i and j < block_j:
+            opcodes.append(('replace', i, block_i, j, block_j))
+        elif i < block_i:
+            opcodes.append(('delete', i, block_i, j, block_j))
+        elif j < block_j:
+            opcodes.append(('insert', i, block_i, j, block_j))
+        if size:
+            opcodes.append(('equal', block_i, block_i + size, block_j, block_j + size))
+        i, j = block_i + size, block_j + size
+    return opcodes
+
+def _merge_blocks(blocks):
+    """Une bloques coincidentes contiguos"""
+    merged = []
+    for block_i, block_j, size in blocks:
+        if merged:
+            last_i, last_j, last_size = merged[-1]
+            if last_i + last_size == block_i and last_j + last_size == block_j:
+                merged[-1] = (last_i, last_j, last_size + size)
+                continue
+        merged.append((block_i, block_j, size))
+    return merged
+
+def _trim_common(a, b, a_lo, a_hi, b_lo, b_hi, blocks):
+    """Separa prefijo y sufijo comunes de un rango y los registra como bloques"""
+    start = a_lo
+    while a_lo < a_hi and b_lo < b_hi and a[a_lo] == b[b_lo]:
+        a_lo += 1
+        b_lo += 1
+    if a_lo > start:
+        blocks.append((start, b_lo - (a_lo - start), a_lo - start))
+
+    size = 0
+    while a_lo < a_hi - size and b_lo < b_hi - size and a[a_hi - size - 1] == b[b_hi - size - 1]:
+        size += 1
+    if size:
+        a_hi -= size
+        b_hi -= size
+        blocks.append((a_hi, b_hi, size))
+    return a_lo, a_hi, b_lo, b_hi
+
+def _myers_blocks(a, b, a_lo, a_hi, b_lo, b_hi, blocks):
+    """Myers O((N+M)D) en espacio lineal (divide y vencerás por el snake medio)"""
+    pending = [(a_lo, a_hi, b_lo, b_hi)]
+    while pending:
+        a_lo, a_hi, b_lo, b_hi = _trim_common(a, b, *pending.pop(), blocks)
+        if a_lo == a_hi or b_lo == b_hi:
+            continue
+        split = _myers_middle_snake(a, b, a_lo, a_hi, b_lo, b_hi)
+        if split is None:
+            continue
+        x, y = split
+        pending.append((x, a_hi, y, b_hi))
+        pending.append((a_lo, x, b_lo, y))
+
+def _myers_middle_snake(a, b, a_lo, a_hi, b_lo, b_hi):
+    """Busca el punto donde se cruzan los recorridos hacia adelante y hacia atrás"""
+    n = a_hi - a_lo
+    m = b_hi - b_lo
+    max_d = (n + m + 1) // 2
+    offset = max_d
+    size = 2 * max_d + 2
+    forward = [-1] * size
+    backward = [-1] * size
+    forward[offset + 1] = 0
+    backward[offset + 1] = 0
+    delta = n - m
+    odd = delta % 2 != 0
+    k1_start = k1_end = k2_start = k2_end = 0
+
+    for d in range(max_d):
+        for k1 in range(-d + k1_start, d + 1 - k1_end, 2):
+            k1_offset = offset + k1
+            if k1 == -d or (k1 != d and forward[k1_offset - 1] < forward[k1_offset + 1]):
+                x1 = forward[k1_offset + 1]
+            else:
+                x1 = forward[k1_offset - 1] + 1
+            y1 = x1 - k1
+            while x1 < n and y1 < m and a[a_lo + x1] == b[b_lo + y1]:
+                x1 += 1
+                y1 += 1
+            forward[k1_offset] = x1
+            if x1 > n:
+                k1_end += 2
+            elif y1 > m:
+                k1_start += 2
+            elif odd:
+                k2_offset = offset + delta - k1
+                if 0 <= k2_offset < size and backward[k2_offset] != -1:
+                    if x1 >= n - backward[k2_offset]:
+                        return a_lo + x1, b_lo + y1
+
+        for k2 in range(-d + k2_start, d + 1 - k2_end, 2):
+            k2_offset = offset + k2
+            if k2 == -d or (k2 != d and backward[k2_offset - 1] < backward[k2_offset + 1]):
+                x2 = backward[k2_offset + 1]
+            else:
+                x2 = backward[k2_offset - 1] + 1
+            y2 = x2 - k2
+            while x2 < n and y2 < m and a[a_hi - x2 - 1] == b[b_hi - y2 - 1]:
+                x2 += 1
+                y2 += 1
+            backward[k2_offset] = x2
+            if x2 > n:
+                k2_end += 2
+            elif y2 > m:
+                k2_start += 2
+            elif not odd:
+                k1_offset = offset + delta - k2
+                if 0 <= k1_offset < size and forward[k1_offset] != -1:
+                    x1 = forward[k1_offset]
+                    y1 = offset + x1 - k1_offset
+                    if x1 >= n - x2:
+                        return a_lo + x1, b_lo + y1
+    return None
+
+def _patience_blocks(a, b, a_lo, a_hi, b_lo, b_hi, blocks):
+    """Patience diff: ancla en líneas únicas en ambos lados y recurre entre anclas"""
+    pending = [(a_lo, a_hi, b_lo, b_hi)]
+    while pending:
+        a_lo, a_hi, b_lo, b_hi = _trim_common(a, b, *pending.pop(), blocks)
+        if a_lo == a_hi or b_lo == b_hi:
+            continue
+        anchors = _unique_anchors(a, b, a_lo, a_hi, b_lo, b_hi)
+        if not anchors:
+            _myers_blocks(a, b, a_lo, a_hi, b_lo, b_hi, blocks)
+            continue
+        prev_i, prev_j = a_lo, b_lo
+        for i, j in anchors:
+            pending.append((prev_i, i, prev_j, j))
+            blocks.append((i, j, 1))
+            prev_i, prev_j = i + 1, j + 1
+        pending.append((prev_i, a_hi, prev_j, b_hi))
+
+def _unique_anchors(a, b, a_lo, a_hi, b_lo, b_hi):
+    """Subsecuencia creciente más larga de líneas que aparecen una sola vez en cada lado"""
+    counts = {}
+    for i in range(a_lo, a_hi):
+        entry = counts.get(a[i])
+        counts[a[i]] = [i, None, 1] if entry is None else [entry[0], None, entry[2] + 1]
+    for j in range(b_lo, b_hi):
+        entry = counts.get(b[j])
+        if entry is not None and entry[2] == 1:
+            entry[1] = j if entry[1] is None else -1
+    pairs = sorted((i, j) for i, j, count in counts.values()
+                   if count == 1 and j is not None and j >= 0)
+    if not pairs:
+        return []
+
+    # Patience sorting sobre las posiciones en b
+    tails = []
+    tail_idx = []
+    back = [None] * len(pairs)
+    for idx, (_, j) in enumerate(pairs):
+        pos = bisect.bisect_left(tails, j)
+        if pos == len(tails):
+            tails.append(j)
+            tail_idx.append(idx)
+        else:
+            tails[pos] = j
+            tail_idx[pos] = idx
+        back[idx] = tail_idx[pos - 1] if pos else None
+
+    anchors = []
+    idx = tail_idx[-1]
+    while idx is not None:
+        anchors.append(pairs[idx])
+        idx = back[idx]
+    anchors.reverse()
+    return anchors
+
+def compare_engines(file1_lines, file2_lines, context_lines, max_gap, algorithm='myers'):
+    """
+    Contrasta los hunks de un motor con los del Differ original.
+    Devuelve una lista de discrepancias (vacía si son equivalentes); dentro de
+    cada hunk se ignora el orden de las líneas y la contraparte emparejada.
+    """
+    def hunks(lines_to_show):
+        result, current = [], []
+        for line_type, line_num, content, _ in lines_to_show:
+            if line_type == 'sep':
+                result.append(sorted(current))
+                current = []
+            else:
+                current.append((line_type, line_num, content))
+        return result
+
+    expected = hunks(build_hunks(file1_lines, file2_lines, context_lines, max_gap, 'differ'))
+    actual = hunks(build_hunks(file1_lines, file2_lines, context_lines, max_gap, algorithm))
+
+    mismatches = []
+    for idx in range(max(len(expected), len(actual))):
+        old = expected[idx] if idx < len(expected) else []
+        new = actual[idx] if idx < len(actual) else []
+        if old != new:
+            only_old = [line for line in old if line not in new]
+            only_new = [line for line in new if line not in old]
+            mismatches.append(f"hunk {idx + 1}: solo Differ {only_old[:3]}, solo {algorithm} {only_new[:3]}")
+    return mismatches
+
+WORD_PATTERN = re.compile(r'\w+|\s+|[^\w\s]')
+
+@lru_cache(maxsize=HIGHLIGHT_CACHE_SIZE)
+def intraline_spans(old, new, mode=HIGHLIGHT_WORDS):
+    """
+    Fragmentos cambiados entre una línea borrada y su homóloga añadida:
+    ((inicio, fin) en old, (inicio, fin) en new), o None si no merece la pena
+    resaltarlos. Los filtros van de más barato a más caro: relación de
+    longitudes, real_quick_ratio, quick_ratio y por último ratio; el LRU
+    evita repetir el SequenceMatcher para pares de líneas ya vistos.
+    """
+    if not old or not new or old == new:
+        return None
+    if min(len(old), len(new)) < HIGHLIGHT_LENGTH_RATIO * max(len(old), len(new)):
+        return None
+
+    if mode == HIGHLIGHT_CHARS:
+        a, b = old, new
+    else:
+        a, b = WORD_PATTERN.findall(old), WORD_PATTERN.findall(new)
+    matcher = SequenceMatcher(None, a, b, autojunk=False)
+    if (matcher.real_quick_ratio() < HIGHLIGHT_MIN_RATIO
+            or matcher.quick_ratio() < HIGHLIGHT_MIN_RATIO
+            or matcher.ratio() < HIGHLIGHT_MIN_RATIO):
+        return None
+
+    offsets_a = _token_offsets(a)
+    offsets_b = _token_offsets(b)
+    old_spans, new_spans = [], []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        _add_span(old_spans, old, offsets_a[i1], offsets_a[i2])
+        _add_span(new_spans, new, offsets_b[j1], offsets_b[j2])
+    return tuple(old_spans), tuple(new_spans)
+
+def _token_offsets(tokens):
+    """Posición en caracteres del inicio de cada token (y del final)"""
+    offsets = [0]
+    for token in tokens:
+        offsets.append(offsets[-1] + len(token))
+    return offsets
+
+def _add_span(spans, line, start, end):
+    """Añade (start, end) fusionándolo con el anterior si se tocan; ignora blancos"""
+    if start >= end or not line[start:end].strip():
+        return
+    if spans and spans[-1][1] >= start:
+        spans[-1] = (spans[-1][0], end)
+    else:
+        spans.append((start, end))
+
+def highlight_row(row, mode=HIGHLIGHT_WORDS):
+    """
+    Sustituye la línea homóloga (cuarto elemento) de un borrado/alta por la
+    tupla de fragmentos cambiados de su contenido; None si no se resalta.
+    """
+    line_type, line_num, content, counterpart = row
+    spans = None
+    if line_type in HIGHLIGHT_COLORS and counterpart:
+        if line_type == 'del':
+            pair = intraline_spans(content, counterpart, mode)
+        else:
+            pair = intraline_spans(counterpart, content, mode)
+        if pair is not None:
+            spans = pair[0] if line_type == 'del' else pair[1]
+    return (line_type, line_num, content, spans or None)
+
+def highlight_rows(lines_to_show, mode=HIGHLIGHT_WORDS):
+    return [highlight_row(row, mode) for row in lines_to_show]
+
+def _open_font():
+    """Carga la fuente monoespaciada de la plataforma"""
+    try:
+        return ImageFont.truetype("consola.ttf", 14) if os.name == 'nt' else ImageFont.truetype("DejaVuSansMono.ttf", 14)
+    except OSError:
+        return ImageFont.load_default()
+
+@lru_cache(maxsize=None)
+def load_font():
+    """Fuente cargada una sola vez por proceso"""
+    return _open_font()
+
+@lru_cache(maxsize=None)
+def get_row_renderer(line_height):
+    """RowRenderer compartido por todas las imágenes del proceso"""
+    return RowRenderer(load_font(), line_height)
+
+class RowRenderer:
+    """
+    Dibuja filas de la comparación reutilizando bitmaps: tiras de fondo por
+    color y ancho, glifos de dígitos para el gutter y máscaras de texto
+    (prefijos y contenido) en un LRU. Las máscaras no dependen del color,
+    que se aplica al pegarlas.
+    """
+
+    def __init__(self, font, line_height, max_masks=ROW_CACHE_SIZE):
+        self.font = font
+        self.line_height = line_height
+        self.max_masks = max_masks
+        self.masks = OrderedDict()
+        self.strips = {}
+        self.widths = {}
+        # Cota del avance de un carácter ASCII: evita medir cada texto
+        self.ascii_advance = max(font.getlength(chr(c)) for c in range(32, 127))
+        # Gutter: un glifo por dígito, compuestos con avance fijo
+        self.digit_advance = font.getlength('0')
+        self.digits = {d: self._render_mask(d, int(self.digit_advance) + 2) for d in '0123456789'}
+
+    def _render_mask(self, text, width):
+        mask = Image.new('L', (max(1, width), self.line_height), 0)
+        ImageDraw.Draw(mask).text((0, 3), text, fill=255, font=self.font)
+        return mask
+
+    def text_width(self, text):
+        width = self.widths.get(text)
+        if width is None:
+            width = self.widths[text] = int(round(self.font.getlength(text)))
+        return width
+
+    def text_mask(self, text):
+        """Máscara 'L' del texto, renderizada una vez y reutilizada"""
+        mask = self.masks.get(text)
+        if mask is not None:
+            self.masks.move_to_end(text)
+            return mask
+
+        if text.isascii():
+            width = int(len(text) * self.ascii_advance) + 2
+        else:
+            width = int(self.font.getlength(text)) + 2
+        mask = self.masks[text] = self._render_mask(text, width)
+        if len(self.masks) > self.max_masks:
+            self.masks.popitem(last=False)
+        return mask
+
+    def strip(self, color, width):
+        """Tira de fondo de una fila para el color (o índice de paleta) y ancho dados"""
+        key = (color, width)
+        strip = self.strips.get(key)
+        if strip is None:
+            mode = 'L' if isinstance(color, int) else 'RGB'
+            strip = self.strips[key] = Image.new(mode, (width, self.line_height + 1), color)
+        return strip
+
+    def paste_text(self, img, position, mask, color, bg_color, palette=None):
+        """
+        Pega una máscara de texto. En modo paleta la máscara se traduce a
+        índices de la rampa fondo/color y se pega entera: sus píxeles vacíos
+        tienen el índice del propio fondo.
+        """
+        if palette is None:
+            img.paste(color, position, mask)
+        else:
+            img.paste(mask.point(palette.lut(bg_color, color)), position)
+
+    def draw_line_number(self, img, x_pos, y_pos, line_num, color, bg_color=None,
+                         palette=None):
+        """Número de línea alineado a 4 posiciones a partir de glifos cacheados"""
+        text = f"{line_num:>4}"
+        for idx, digit in enumerate(text):
+            if digit != ' ':
+                self.paste_text(img, (x_pos + int(round(idx * self.digit_advance)), y_pos),
+                                self.digits[digit], color, bg_color, palette)
+
+    def draw_row(self, img, y_pos, left, right, gutter_width, bg_color, line_num,
+                 num_color, prefix, content, text_color, palette=None, spans=None,
+                 highlight_color=None):
+        fill = bg_color if palette is None else palette.index[bg_color]
+        img.paste(self.strip(fill, right - left + 1), (left, y_pos))
+
+        # Número de línea (si aplica)
+        if line_num is not None:
+            self.draw_line_number(img, left + 5, y_pos, line_num + 1, num_color,
+                                  bg_color, palette)
+
+        # Prefijo y contenido
+        text_x = left + gutter_width
+        if prefix.strip():
+            self.paste_text(img, (text_x, y_pos), self.text_mask(prefix), text_color,
+                            bg_color, palette)
+        if content and content.strip():
+            content_x = text_x + self.text_width(prefix)
+            self.paste_text(img, (content_x, y_pos), self.text_mask(content), text_color,
+                            bg_color, palette)
+            if spans:
+                self.draw_spans(img, content_x, y_pos, content, spans, text_color,
+                                highlight_color, palette)
+
+    def draw_spans(self, img, x_pos, y_pos, content, spans, text_color, bg_color,
+                   palette=None):
+        """Repinta los fragmentos cambiados con fondo resaltado y su texto encima"""
+        fill = bg_color if palette is None else palette.index[bg_color]
+        for start, end in spans:
+            x0 = x_pos + int(round(self.font.getlength(content[:start])))
+            x1 = x_pos + int(round(self.font.getlength(content[:end])))
+            if x1 <= x0:
+                continue
+            img.paste(fill, (x0, y_pos, x1, y_pos + self.line_height + 1))
+            mask = self.text_mask(content[start:end]).crop((0, 0, x1 - x0, self.line_height))
+            self.paste_text(img, (x0, y_pos), mask, text_color, bg_color, palette)
+
+class PngPalette:
+    """
+    Paleta fija de las imágenes PNG: fondo, separador y, por cada estilo de
+    LINE_STYLES, una rampa de PALETTE_LEVELS tonos entre el fondo y el color
+    del texto (y otra hacia el del número de línea) que conserva el antialias,
+    más las del texto sobre los fondos de HIGHLIGHT_COLORS.
+    El primer tono de cada rampa es el propio fondo.
+    """
+
+    def __init__(self, levels=PALETTE_LEVELS):
+        self.levels = levels
+        self.colors = []
+        self.index = {}
+        self.ramps = {}
+        self.luts = {}
+        self._add(BACKGROUND_COLOR)
+        self._add(SEPARATOR_COLOR)
+        for bg_color, text_color, _, num_color in LINE_STYLES.values():
+            for color in (text_color, num_color):
+                self._add_ramp(bg_color, color)
+        for line_type, bg_color in HIGHLIGHT_COLORS.items():
+            self._add_ramp(bg_color, LINE_STYLES[line_type][1])
+        if len(self.colors) > 256:
+            raise ValueError(f"La paleta PNG admite 256 colores, se necesitan {len(self.colors)}")
+
+    def _add(self, color):
+        self.index.setdefault(color, len(self.colors))
+        self.colors.append(color)
+
+    def _add_ramp(self, bg_color, color):
+        if (bg_color, color) in self.ramps:
+            return
+        self.ramps[(bg_color, color)] = len(self.colors)
+        top = self.levels - 1
+        for level in range(self.levels):
+            self._add(tuple(round(b + (c - b) * level / top) for b, c in zip(bg_color, color)))
+
+    def lut(self, bg_color, color):
+        """Tabla para Image.point: valor de la máscara (0-255) -> índice en la rampa"""
+        key = (bg_color, color)
+        lut = self.luts.get(key)
+        if lut is None:
+            base, top = self.ramps[key], self.levels - 1
+            lut = self.luts[key] = [base + (value * top + 127) // 255 for value in range(256)]
+        return lut
+
+    def flat(self):
+        """Lista plana R, G, B... para Image.putpalette"""
+        return [channel for color in self.colors for channel in color]
+
+@lru_cache(maxsize=None)
+def get_png_palette():
+    """Paleta compartida por todas las imágenes del proceso"""
+    return PngPalette()
+
+class PngEncoder:
+    """
+    Guarda las páginas PNG: en paleta o RGB, con el nivel de compresión y
+    optimize de zlib indicados, y con el ancho limitado a max_width píxeles.
+    En modo 'wrap' las líneas largas se parten en filas de continuación antes
+    de dibujar; en modo 'tile' la página se corta en franjas verticales
+    (_c2, _c3...). Con threads > 1 páginas y franjas se codifican en un pool
+    de hilos (zlib libera el GIL) mientras se dibuja la página siguiente.
+    """
+
+    def __init__(self, palette=True, compress_level=PNG_COMPRESS_LEVEL, optimize=False,
+                 max_width=0, wide_lines='wrap', threads=1):
+        self.palette = palette
+        self.compress_level = compress_level
+        self.optimize = optimize
+        self.max_width = max_width
+        self.wide_lines = wide_lines
+        self.threads = max(1, threads or os.cpu_count() or 1)
+        self.wrap_chars = None
+        if max_width and wide_lines == 'wrap':
+            usable = max_width - (MARGIN * 4) - (GUTTER_WIDTH * 2)
+            self.wrap_chars = max(1, usable // CHAR_WIDTH)
+        self.pending = deque()
+        self.generated = []
+        self.executor = None
+
+    def wrap_row(self, row):
+        """
+        Parte una fila en filas de continuación (sin número de línea) si no
+        cabe; los fragmentos resaltados se recortan a cada trozo.
+        """
+        line_type, line_num, content, extra = row
+        limit = self.wrap_chars
+        if limit is None or not content or len(content) <= limit:
+            return (row,)
+        parts = []
+        for start in range(0, len(content), limit):
+            end = start + limit
+            if isinstance(extra, tuple):
+                part_extra = tuple((max(s, start) - start, min(e, end) - start)
+                                   for s, e in extra if s < end and e > start) or None
+            else:
+                part_extra = extra
+            parts.append((line_type, line_num if start == 0 else None, content[start:end],
+                          part_extra))
+        return parts
+
+    def wrap(self, rows):
+        if self.wrap_chars is None:
+            return rows
+        return [part for row in rows for part in self.wrap_row(row)]
+
+    def tiles(self, img, final_path):
+        """(imagen, ruta) de cada franja; la primera conserva la ruta de la página"""
+        if self.wide_lines != 'tile' or not self.max_width or img.width <= self.max_width:
+            return [(img, final_path)]
+        stem, ext = os.path.splitext(final_path)
+        return [(img.crop((x, 0, min(x + self.max_width, img.width), img.height)),
+                 final_path if x == 0 else f"{stem}_c{x // self.max_width + 1}{ext}")
+                for x in range(0, img.width, self.max_width)]
+
+    def _encode(self, img, path):
+        img.save(path, format='PNG', compress_level=self.compress_level, optimize=self.optimize)
+        return os.path.getsize(path)
+
+    def submit(self, img, final_path, stats=None):
+        """Guarda la página (o la encola si hay hilos); la cola se limita a 2 por hilo"""
+        stats = stats or NULL_STATS
+        with stats.phase('guardado'):
+            os.makedirs(os.path.dirname(final_path) or '.', exist_ok=True)
+            for tile, path in self.tiles(img, final_path):
+                if self.threads == 1:
+                    self._done(path, self._encode(tile, path), stats)
+                    continue
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(max_workers=self.threads)
+                self.pending.append((path, self.executor.submit(self._encode, tile, path)))
+                while len(self.pending) > 2 * self.threads:
+                    self._collect(stats)
+
+    def _collect(self, stats):
+        path, future = self.pending.popleft()
+        self._done(path, future.result(), stats)
+
+    def _done(self, path, size, stats):
+        stats.count('imagenes')
+        stats.count('bytes_escritos', size)
+        print(f"  Imagen generada: {os.path.basename(path)}")
+        self.generated.append(path)
+
+    def finish(self, stats=None):
+        """Espera a las codificaciones pendientes y devuelve las rutas en orden"""
+        stats = stats or NULL_STATS
+        try:
+            with stats.phase('guardado'):
+                while self.pending:
+                    self._collect(stats)
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+        generated, self.generated = self.generated, []
+        return generated
+
+def png_encoder(options):
+    """PngEncoder configurado con las opciones png_* de make_options"""
+    return PngEncoder(options['png_palette'], options['png_compress_level'],
+                      options['png_optimize'], options['max_width'], options['wide_lines'],
+                      options['encode_threads'])
+
 def generate_comparison_images(lines_to_show, output_path, split_images, 
-                             max_height, highlight_partial, is_new_file):
-    """Genera imágenes solo si hay contenido válido"""
+                             max_height, highlight_partial, is_new_file, render_cache=True,
+                             stats=None, encoder=None):
+    """
+    Genera imágenes solo si hay contenido válido; devuelve sus rutas.
+    Con render_cache se reutilizan fuente, fondos y máscaras de texto entre
+    llamadas del mismo proceso; sin él se dibuja cada texto con draw.text.
+    encoder (PngEncoder) decide paleta, compresión y ancho máximo.
+    highlight_partial (HIGHLIGHT_WORDS o HIGHLIGHT_CHARS) resalta los
+    fragmentos cambiados de cada línea respecto a su homóloga.
+    """
     if not lines_to_show:
-        return
+        return []
+    encoder = encoder or PngEncoder()
+    if highlight_partial:
+        lines_to_show = highlight_rows(lines_to_show, highlight_partial)
+    lines_to_show = encoder.wrap(lines_to_show)
 
     # Configuración visual
-    try:
-        font = ImageFont.truetype("consola.ttf", 14) if os.name == 'nt' else ImageFont.truetype("DejaVuSansMono.ttf", 14)
-    except:
-        font = ImageFont.load_default()
-    
-    line_height = 20
-    char_width = 8
-    margin = 10
-    gutter_width = 60
+    line_height = LINE_HEIGHT
+    margin = MARGIN
     
     # Calcular dimensiones
-    max_line_length = max((len(line[2]) for line in lines_to_show if line[2]), default=50)
-    img_width = (max_line_length * char_width) + (margin * 4) + (gutter_width * 2)
+    img_width = _image_width(lines_to_show)
 
     # Función para crear imagen individual
     def create_image(start_idx, end_idx, img_num):
-        img_height = ((end_idx - start_idx) * line_height) + (margin * 2)
-        img = Image.new('RGB', (img_width, img_height), color=(30, 30, 30))
-        draw = ImageDraw.Draw(img)
-        
-        y_pos = margin
-        for i in range(start_idx, end_idx):
-            line_type, line_num, content, _ = lines_to_show[i]
-            
-            if line_type == 'sep':
-                draw.line([(margin, y_pos + line_height//2), 
-                          (img_width - margin, y_pos + line_height//2)], 
-                         fill=(80, 80, 80), width=1)
-                y_pos += line_height
-                continue
-            
-            # Estilos
-            if is_new_file:
-                bg_color = (20, 50, 20)  # Fondo verde oscuro
-                text_color = (150, 255, 150)  # Texto verde claro
-                prefix = '+ '
-                num_color = (100, 255, 100)
-            else:
-                bg_color, text_color, prefix, num_color = {
-                    'del': ((70, 30, 30), (255, 180, 180), '- ', (255, 150, 150)),
-                    'add': ((30, 70, 30), (180, 255, 180), '+ ', (150, 255, 150)),
-                    'ctx': ((45, 45, 45), (200, 200, 200), '  ', (150, 150, 150))
-                }.get(line_type, ((45, 45, 45), (200, 200, 200), '  ', (150, 150, 150)))
-            
-            # Dibujar línea
-            draw.rectangle([(margin, y_pos), (img_width - margin, y_pos + line_height)], 
-                          fill=bg_color)
-            
-            # Número de línea (si aplica)
-            if line_num is not None:
-                draw.text((margin + 5, y_pos + 3), f"{line_num + 1:>4}", 
-                         fill=num_color, font=font)
-            
-            # Contenido
-            text_x = margin + gutter_width
-            draw.text((text_x, y_pos + 3), prefix, fill=text_color, font=font)
-            draw.text((text_x + font.getlength(prefix), y_pos + 3), 
-                     content, fill=text_color, font=font)
-            
-            y_pos += line_height
-        
-        # Guardar imagen
         final_path = output_path if img_num == 1 else output_path.replace(".png", f"_{img_num-1}.png")
-        img.save(final_path)
-        print(f"  Imagen generada: {os.path.basename(final_path)}")
+        render_png_page(lines_to_show[start_idx:end_idx], final_path, img_width,
+                        is_new_file, render_cache, stats, encoder)
 
     # Generar una o múltiples imágenes
     if not split_images or len(lines_to_show) * line_height <= max_height:
@@ -261,16 +1942,449 @@ def generate_comparison_images(lines_to_show, output_path, split_images,
         if current_start < len(lines_to_show):
             create_image(current_start, len(lines_to_show), img_num)
 
-# Ejemplo de uso
-if __name__ == "__main__":
+    return encoder.finish(stats)
+
+def _image_width(rows):
+    """Ancho en píxeles necesario para mostrar las filas"""
+    return (_report_width(rows) * CHAR_WIDTH) + (MARGIN * 4) + (GUTTER_WIDTH * 2)
+
+def render_png_page(rows, final_path, img_width, is_new_file, render_cache=True, stats=None,
+                    encoder=None):
+    """
+    Dibuja una imagen con las filas indicadas y la entrega al codificador;
+    sin encoder se guarda en el momento y se devuelven las rutas escritas.
+    """
+    stats = stats or NULL_STATS
+    own_encoder = encoder is None
+    encoder = encoder or PngEncoder()
+    with stats.phase('dibujo'):
+        img = _draw_png_page(rows, img_width, is_new_file, render_cache, encoder.palette)
+    
+    # Guardar imagen
+    encoder.submit(img, final_path, stats)
+    if own_encoder:
+        return encoder.finish(stats)
+
+def _draw_png_page(rows, img_width, is_new_file, render_cache=True, palette=False):
+    line_height = LINE_HEIGHT
+    margin = MARGIN
+    gutter_width = GUTTER_WIDTH
+    if render_cache:
+        font = load_font()
+        renderer = get_row_renderer(line_height)
+    else:
+        font = _open_font()
+        renderer = None
+
+    # En modo paleta se dibuja sobre 'L' con índices y al final se asigna la
+    # paleta (la imagen pasa a 'P'); draw.text no puede mezclar índices, así
+    # que sin caché cada texto se dibuja con antialias en una máscara que se
+    # cuantiza a la rampa fondo/color, como hace RowRenderer
+    png_palette = get_png_palette() if palette else None
+    def color(rgb):
+        return rgb if png_palette is None else png_palette.index[rgb]
+
+    def draw_text(x_pos, y_pos, text, bg_color, text_color):
+        if png_palette is None:
+            draw.text((x_pos, y_pos + 3), text, fill=text_color, font=font)
+            return
+        mask = Image.new('L', (max(1, int(font.getlength(text)) + 2), line_height), 0)
+        ImageDraw.Draw(mask).text((0, 3), text, fill=255, font=font)
+        img.paste(mask.point(png_palette.lut(bg_color, text_color)),
+                  (int(round(x_pos)), y_pos), mask.point(TEXT_COVERAGE_LUT))
+
+    img_height = (len(rows) * line_height) + (margin * 2)
+    img = Image.new('RGB' if png_palette is None else 'L', (img_width, img_height),
+                    color=color(BACKGROUND_COLOR))
+    draw = ImageDraw.Draw(img)
+    
+    y_pos = margin
+    for line_type, line_num, content, extra in rows:
+        if line_type == 'sep':
+            draw.line([(margin, y_pos + line_height//2), 
+                      (img_width - margin, y_pos + line_height//2)], 
+                     fill=color(SEPARATOR_COLOR), width=1)
+            y_pos += line_height
+            continue
+        
+        # Estilos
+        bg_color, text_color, prefix, num_color = line_style(line_type, is_new_file)
+        # Con highlight_rows el cuarto elemento son los fragmentos cambiados
+        spans = extra if isinstance(extra, tuple) and not is_new_file else None
+        highlight_color = HIGHLIGHT_COLORS.get(line_type)
+        
+        if renderer is not None:
+            renderer.draw_row(img, y_pos, margin, img_width - margin, gutter_width,
+                              bg_color, line_num, num_color, prefix, content, text_color,
+                              png_palette, spans, highlight_color)
+            y_pos += line_height
+            continue
+        
+        # Dibujar línea
+        draw.rectangle([(margin, y_pos), (img_width - margin, y_pos + line_height)], 
+                      fill=color(bg_color))
+        text_x = margin + gutter_width
+        content_x = text_x + font.getlength(prefix)
+        
+        # Número de línea (si aplica)
+        if line_num is not None:
+            draw_text(margin + 5, y_pos, f"{line_num + 1:>4}", bg_color, num_color)
+        
+        # Contenido
+        draw_text(text_x, y_pos, prefix, bg_color, text_color)
+        draw_text(content_x, y_pos, content, bg_color, text_color)
+        
+        # Fragmentos cambiados: fondo resaltado y su texto encima
+        for start, end in spans or ():
+            x0 = content_x + font.getlength(content[:start])
+            draw.rectangle([(x0, y_pos),
+                            (content_x + font.getlength(content[:end]) - 1, y_pos + line_height)],
+                           fill=color(highlight_color))
+            draw_text(x0, y_pos, content[start:end], highlight_color, text_color)
+        
+        y_pos += line_height
+    
+    if png_palette is not None:
+        img.putpalette(png_palette.flat())
+    return img
+
+class PagedImageWriter:
+    """
+    Recibe filas una a una y vuelca cada imagen en cuanto se llena
+    (max_height), con el mismo criterio de corte que generate_comparison_images.
+    Cada página calcula su propio ancho; la memoria queda acotada a una página.
+    """
+
+    def __init__(self, output_path, max_height, is_new_file, render_cache=True, stats=None,
+                 encoder=None, highlight_partial=0):
+        self.output_path = output_path
+        self.stats = stats
+        self.encoder = encoder or PngEncoder()
+        self.highlight_partial = highlight_partial
+        self.is_new_file = is_new_file
+        self.render_cache = render_cache
+        self.max_height = max_height
+        self.max_lines = max(1, (max_height - 2 * MARGIN) // LINE_HEIGHT)
+        self.rows = []
+        self.pages = 0
+
+    def add(self, row):
+        if self.highlight_partial:
+            row = highlight_row(row, self.highlight_partial)
+        for part in self.encoder.wrap_row(row):
+            self._add(part)
+
+    def _add(self, row):
+        self.rows.append(row)
+        if len(self.rows) <= self.max_lines:
+            return
+        # Como en el modo no streaming: cortar tras un separador cercano
+        if row[0] == 'sep':
+            self.flush(len(self.rows))
+        elif len(self.rows) >= self.max_lines + 10:
+            self.flush(self.max_lines)
+
+    def flush(self, count):
+        page, self.rows = self.rows[:count], self.rows[count:]
+        self.pages += 1
+        final_path = (self.output_path if self.pages == 1
+                      else self.output_path.replace(".png", f"_{self.pages-1}.png"))
+        render_png_page(page, final_path, _image_width(page), self.is_new_file,
+                        self.render_cache, self.stats, self.encoder)
+
+    def close(self):
+        """Vuelca las filas pendientes y devuelve las rutas generadas"""
+        if not self.pages and len(self.rows) * LINE_HEIGHT <= self.max_height:
+            self.flush(len(self.rows))
+        while len(self.rows) > self.max_lines:
+            split_at = self.max_lines
+            for j in range(self.max_lines, min(self.max_lines + 10, len(self.rows))):
+                if self.rows[j][0] == 'sep':
+                    split_at = j + 1
+                    break
+            self.flush(split_at)
+        if self.rows:
+            self.flush(len(self.rows))
+        return self.encoder.finish(self.stats)
+
+def _report_width(lines_to_show):
+    """Longitud (en caracteres) de la línea más larga a mostrar"""
+    return max((len(line[2]) for line in lines_to_show if line[2]), default=50)
+
+def _css_color(color):
+    return '#%02x%02x%02x' % color
+
+def generate_html_report(lines_to_show, output_path, split_images,
+                         max_height, highlight_partial, is_new_file, stats=None):
+    """Genera un reporte HTML autocontenido (split_images y max_height no aplican)"""
+    if not lines_to_show:
+        return []
+    if highlight_partial and not is_new_file:
+        lines_to_show = highlight_rows(lines_to_show, highlight_partial)
+
+    styles = [f"body{{background:{_css_color(BACKGROUND_COLOR)};margin:10px;"
+              "font:14px/20px Consolas,'DejaVu Sans Mono',monospace}",
+              "table{border-collapse:collapse;min-width:100%}",
+              "td{white-space:pre;padding:0 5px;height:20px}",
+              "td.n{width:50px;text-align:right}",
+              f"tr.sep td{{border-top:1px solid {_css_color(SEPARATOR_COLOR)};height:10px}}"]
+    for line_type, (bg_color, text_color, _, num_color) in LINE_STYLES.items():
+        styles.append(f"tr.{line_type}{{background:{_css_color(bg_color)};"
+                      f"color:{_css_color(text_color)}}}")
+        styles.append(f"tr.{line_type} td.n{{color:{_css_color(num_color)}}}")
+    for line_type, color in HIGHLIGHT_COLORS.items():
+        styles.append(f"tr.{line_type} span{{background:{_css_color(color)}}}")
+
+    title = html.escape(os.path.basename(output_path))
+    rows = []
+    for line_type, line_num, content, extra in lines_to_show:
+        if line_type == 'sep':
+            rows.append('<tr class="sep"><td colspan="2"></td></tr>')
+            continue
+        css_class = 'new' if is_new_file else (line_type if line_type in LINE_STYLES else 'ctx')
+        prefix = line_style(line_type, is_new_file)[2]
+        number = '' if line_num is None else line_num + 1
+        text = html.escape(prefix) + _html_spans(content, extra if isinstance(extra, tuple) else ())
+        rows.append(f'<tr class="{css_class}"><td class="n">{number}</td>'
+                    f'<td>{text}</td></tr>')
+
+    header = (f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{title}</title>\n'
+              f'<style>{"".join(styles)}</style></head>\n<body><table>')
+    return _write_text_output(output_path, [header] + rows + ['</table></body></html>'],
+                              "Reporte generado", stats)
+
+def _html_spans(content, spans):
+    """Contenido escapado con los fragmentos cambiados dentro de <span>"""
+    parts = []
+    last = 0
+    for start, end in spans:
+        parts.append(html.escape(content[last:start]))
+        parts.append(f'<span>{html.escape(content[start:end])}</span>')
+        last = end
+    parts.append(html.escape(content[last:]))
+    return ''.join(parts)
+
+def generate_svg_report(lines_to_show, output_path, split_images,
+                        max_height, highlight_partial, is_new_file, stats=None):
+    """Genera un SVG vectorial con el mismo diseño que las imágenes PNG"""
+    if not lines_to_show:
+        return []
+    if highlight_partial and not is_new_file:
+        lines_to_show = highlight_rows(lines_to_show, highlight_partial)
+
+    line_height = LINE_HEIGHT
+    char_width = CHAR_WIDTH
+    margin = MARGIN
+    gutter_width = GUTTER_WIDTH
+    img_width = _image_width(lines_to_show)
+    img_height = (len(lines_to_show) * line_height) + (margin * 2)
+
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{img_width}" height="{img_height}" '
+             f'font-family="Consolas, DejaVu Sans Mono, monospace" font-size="14" xml:space="preserve">',
+             f'<rect width="100%" height="100%" fill="{_css_color(BACKGROUND_COLOR)}"/>']
+    y_pos = margin
+    for line_type, line_num, content, extra in lines_to_show:
+        if line_type == 'sep':
+            y_mid = y_pos + line_height // 2
+            parts.append(f'<line x1="{margin}" y1="{y_mid}" x2="{img_width - margin}" y2="{y_mid}" '
+                         f'stroke="{_css_color(SEPARATOR_COLOR)}"/>')
+            y_pos += line_height
+            continue
+
+        bg_color, text_color, prefix, num_color = line_style(line_type, is_new_file)
+        baseline = y_pos + 15
+        parts.append(f'<rect x="{margin}" y="{y_pos}" width="{img_width - 2 * margin}" '
+                     f'height="{line_height}" fill="{_css_color(bg_color)}"/>')
+        if isinstance(extra, tuple):
+            text_x = margin + gutter_width + len(prefix) * char_width
+            highlight = _css_color(HIGHLIGHT_COLORS[line_type])
+            for start, end in extra:
+                parts.append(f'<rect x="{text_x + start * char_width}" y="{y_pos}" '
+                             f'width="{(end - start) * char_width}" height="{line_height}" '
+                             f'fill="{highlight}"/>')
+        if line_num is not None:
+            parts.append(f'<text x="{margin + 5}" y="{baseline}" fill="{_css_color(num_color)}">'
+                         f'{line_num + 1:>4}</text>')
+        parts.append(f'<text x="{margin + gutter_width}" y="{baseline}" fill="{_css_color(text_color)}">'
+                     f'{html.escape(prefix + content)}</text>')
+        y_pos += line_height
+    parts.append('</svg>')
+
+    return _write_text_output(output_path, parts, "Imagen generada", stats)
+
+def generate_unified_diff(lines_to_show, output_path, split_images,
+                          max_height, highlight_partial, is_new_file, stats=None):
+    """Genera un diff de texto estilo unificado, un hunk por grupo de cambios"""
+    if not lines_to_show:
+        return []
+
+    # Diferencia acumulada (línea en file2 - línea en file1) antes de cada
+    # hunk: el contexto trae la numeración de file1 y las altas la de file2
+    offset = 0
+
+    def hunk_lines(hunk):
+        nonlocal offset
+        dels = sum(1 for kind, _, _ in hunk if kind == 'del')
+        adds = sum(1 for kind, _, _ in hunk if kind in ('add', 'new'))
+        ctx = len(hunk) - dels - adds
+        if is_new_file:
+            return [f"@@ -0,0 +1,{adds} @@"] + ['+' + content for _, _, content in hunk]
+        first = next(idx for idx, (kind, _, _) in enumerate(hunk) if kind != 'ctx')
+        kind, num = hunk[first][:2]
+        file1_first = num if kind == 'del' else num - offset
+        old_count, new_count = ctx + dels, ctx + adds
+        # Como en diff -u: un rango vacío se numera con la línea anterior
+        old_start = file1_first - first + (1 if old_count else 0)
+        new_start = file1_first + offset - first + (1 if new_count else 0)
+        offset += adds - dels
+        markers = {'del': '-', 'add': '+'}
+        return ([f"@@ -{old_start},{old_count} +{new_start},{new_count} @@"] +
+                [markers.get(kind, ' ') + content for kind, _, content in hunk])
+
+    output = []
+    hunk = []
+    for line_type, line_num, content, _ in lines_to_show:
+        if line_type == 'sep':
+            if hunk:
+                output.extend(hunk_lines(hunk))
+            hunk = []
+        else:
+            hunk.append((line_type, line_num, content))
+    if hunk:
+        output.extend(hunk_lines(hunk))
+
+    return _write_text_output(output_path, output, "Diff generado", stats)
+
+def _write_text_output(output_path, lines, message, stats=None):
+    """Escribe la salida de un formato de texto y registra sus métricas"""
+    stats = stats or NULL_STATS
+    with stats.phase('guardado'):
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines))
+            f.write('\n')
+    stats.count('imagenes')
+    stats.count('bytes_escritos', os.path.getsize(output_path))
+    print(f"  {message}: {os.path.basename(output_path)}")
+    return [output_path]
+
+# Formatos de salida: nombre -> (extensión, función). Todas reciben el mismo
+# lines_to_show que produce process_diff/build_hunks y devuelven las rutas.
+RENDERERS = {
+    'png': ('.png', generate_comparison_images),
+    'html': ('.html', generate_html_report),
+    'svg': ('.svg', generate_svg_report),
+    'unified': ('.diff', generate_unified_diff),
+}
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Comparador de directorios con evidencia en imágenes')
+    parser.add_argument('dir1', help='Directorio base')
+    parser.add_argument('dir2', help='Directorio modificado')
+    parser.add_argument('output_dir', nargs='?', default='evidencia_construccion',
+                       help='Directorio de salida (por defecto: evidencia_construccion)')
+    parser.add_argument('--context-lines', type=int, default=2,
+                       help='Líneas de contexto alrededor de cada cambio')
+    parser.add_argument('--max-gap', type=int, default=5,
+                       help='Distancia máxima para agrupar cambios en un mismo hunk')
+    parser.add_argument('--split-images', action='store_true',
+                       help='Dividir las imágenes que superen --max-height')
+    parser.add_argument('--max-height', type=int, default=1000,
+                       help='Altura máxima de cada imagen al dividir')
+    parser.add_argument('--extensions', nargs='+', dest='file_extensions',
+                       help='Procesar solo estas extensiones (ej: .py .cs)')
+    parser.add_argument('--no-prefilter', action='store_false', dest='prefilter',
+                       help='Desactivar el descarte de archivos idénticos por hash')
+    parser.add_argument('--engine', choices=DIFF_ENGINES, default='myers', dest='diff_engine',
+                       help='Motor de diferencias (por defecto: myers)')
+    parser.add_argument('--verify-engine', action='store_true',
+                       help='Contrastar los hunks del motor elegido con Differ')
+    parser.add_argument('--workers', type=int, default=1,
+                       help='Procesos en paralelo (0 = todos los núcleos)')
+    parser.add_argument('--format', choices=sorted(RENDERERS), default='png', dest='renderer',
+                       help='Formato de salida (por defecto: png)')
+    parser.add_argument('--streaming', action='store_true',
+                       help='Procesar por ventanas con memoria acotada (archivos muy grandes)')
+    parser.add_argument('--no-cache', action='store_false', dest='result_cache',
+                       help='No reutilizar ni guardar resultados en caché')
+    parser.add_argument('--clear-cache', action='store_true',
+                       help='Vaciar el caché de resultados antes de comparar')
+    parser.add_argument('--cache-max-mb', type=int, default=RESULT_CACHE_MAX_BYTES >> 20,
+                       help='Tamaño máximo del caché de resultados en MB')
+    parser.add_argument('--report', dest='report_path',
+                       help='Escribir métricas por archivo y fase (.json o .csv)')
+    parser.add_argument('--profile', choices=[p for p in PROFILERS if p],
+                       help='Perfilar el proceso principal con cProfile o tracemalloc')
+    parser.add_argument('--no-renames', action='store_false', dest='detect_renames',
+                       help='No emparejar archivos renombrados o movidos')
+    parser.add_argument('--rename-threshold', type=float, default=RENAME_THRESHOLD,
+                       help='Similitud mínima (0-1) para considerar un archivo renombrado')
+    parser.add_argument('--highlight-partial', choices=sorted(HIGHLIGHT_MODES),
+                       help='Resaltar dentro de cada línea lo cambiado, por palabras o caracteres')
+    parser.add_argument('--sql-canonical', action='store_true',
+                       help='Omitir los .sql que solo cambian en JOIN/NOLOCK, mayúsculas o espacios')
+    parser.add_argument('--rgb', action='store_false', dest='png_palette',
+                       help='Guardar los PNG en RGB en vez de en modo paleta')
+    parser.add_argument('--png-compress', type=int, choices=range(10),
+                       default=PNG_COMPRESS_LEVEL, metavar='0-9',
+                       help=f'Nivel de compresión zlib de los PNG (por defecto: {PNG_COMPRESS_LEVEL})')
+    parser.add_argument('--png-optimize', action='store_true',
+                       help='Buscar la mejor compresión PNG (más lento)')
+    parser.add_argument('--max-width', type=int, default=0,
+                       help='Ancho máximo de los PNG en píxeles (0 = sin límite)')
+    parser.add_argument('--wide-lines', choices=WIDE_LINE_MODES, default='wrap',
+                       help='Con --max-width: partir las líneas largas o cortar la imagen en franjas')
+    parser.add_argument('--encode-threads', type=int, default=1,
+                       help='Hilos para codificar los PNG (0 = todos los núcleos)')
+    parser.add_argument('-r', '--recursive', action='store_true',
+                       help='Comparar también los subdirectorios')
+    parser.add_argument('--exclude', nargs='+',
+                       help='Patrones estilo .gitignore a excluir (por defecto: .git/ bin/ obj/)')
+
+    args = parser.parse_args()
+    if args.streaming and args.diff_engine == 'differ':
+        parser.error("--streaming no admite --engine differ (use myers o patience)")
+
     compare_directories(
-        dir1="A:\Descargas\jesus2501profesional\StressForkMaster\SqlQueryStress\src\SQLQueryStress",
-        dir2="A:\Descargas\jesus2501profesional\SqlQueryStress\src\SQLQueryStress",
-        output_dir="evidencia_construccion",
-        context_lines=2,
-        max_gap=5,
-        split_images=1,
-        max_height=1000,
-        highlight_partial=0,
-        file_extensions=['.py', '.txt', '.cs']  # Opcional: filtrar por extensiones
-    )
\ No newline at end of file
+        dir1=args.dir1,
+        dir2=args.dir2,
+        output_dir=args.output_dir,
+        context_lines=args.context_lines,
+        max_gap=args.max_gap,
+        split_images=int(args.split_images),
+        max_height=args.max_height,
+        highlight_partial=HIGHLIGHT_MODES.get(args.highlight_partial, 0),
+        file_extensions=args.file_extensions,
+        prefilter=args.prefilter,
+        diff_engine=args.diff_engine,
+        verify_engine=args.verify_engine,
+        workers=args.workers,
+        recursive=args.recursive,
+        exclude=args.exclude,
+        renderer=args.renderer,
+        streaming=args.streaming,
+        result_cache=args.result_cache,
+        cache_max_bytes=args.cache_max_mb << 20,
+        clear_cache=args.clear_cache,
+        report_path=args.report_path,
+        profile=args.profile,
+        detect_renames=args.detect_renames,
+        rename_threshold=args.rename_threshold,
+        png_palette=args.png_palette,
+        png_compress_level=args.png_compress,
+        png_optimize=args.png_optimize,
+        max_width=args.max_width,
+        wide_lines=args.wide_lines,
+        encode_threads=args.encode_threads,
+        sql_canonical=args.sql_canonical
+    )
+
+if __name__ == "__main__":
+    main()
+
+# Ejemplo de uso:
+# python filecompare.py "A:\Descargas\jesus2501profesional\StressForkMaster\SqlQueryStress\src\SQLQueryStress" ^
+#     "A:\Descargas\jesus2501profesional\SqlQueryStress\src\SQLQueryStress" evidencia_construccion ^
+#     --recursive --split-images --max-height 1000 --extensions .py .txt .cs
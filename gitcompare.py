@@ -0,0 +1,296 @@
+import os
+import sys
+import subprocess
+
+import filecompare
+
+# Modo de los submódulos: su "blob" es un commit, no hay contenido que comparar
+GIT_SUBMODULE_MODE = '160000'
+# Estados de git diff --raw que llevan ruta de origen y de destino
+PAIRED_STATUSES = ('R', 'C')
+
+def git_output(repo, args):
+    """Ejecuta git en repo y devuelve su salida en bytes; ValueError si falla"""
+    result = subprocess.run(['git', '-C', repo] + args, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        message = result.stderr.decode('utf-8', errors='replace').strip()
+        raise ValueError(f"git {args[0]} falló: {message}")
+    return result.stdout
+
+def changed_files(repo, rev1, rev2, paths=None, detect_renames=True):
+    """
+    Archivos cambiados entre dos revisiones según git diff --raw, como tuplas
+    (estado, ruta1, ruta2, sha1, sha2). El estado es la letra de git (A, D,
+    M, T, R, C); las rutas usan '/' y los submódulos se omiten.
+    """
+    args = ['diff', '--raw', '-z', '--no-abbrev', '--no-ext-diff', '--no-color',
+            '-M' if detect_renames else '--no-renames', rev1, rev2, '--'] + list(paths or ())
+    fields = git_output(repo, args).split(b'\0')
+
+    changes = []
+    i = 0
+    while i < len(fields) - 1:
+        # ":modo1 modo2 sha1 sha2 estado" seguido de una o dos rutas
+        old_mode, new_mode, old_sha, new_sha, status = fields[i].decode('ascii')[1:].split()
+        status = status[0]
+        old_path = os.fsdecode(fields[i + 1])
+        if status in PAIRED_STATUSES:
+            new_path = os.fsdecode(fields[i + 2])
+            i += 3
+        else:
+            new_path = old_path
+            i += 2
+        if GIT_SUBMODULE_MODE not in (old_mode, new_mode):
+            changes.append((status, old_path, new_path, old_sha, new_sha))
+    return changes
+
+class GitBlobReader:
+    """Lee blobs por SHA a través de un único proceso git cat-file --batch"""
+
+    def __init__(self, repo):
+        self.process = subprocess.Popen(['git', '-C', repo, 'cat-file', '--batch'],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def read(self, sha):
+        """Contenido del blob en bytes"""
+        self.process.stdin.write(sha.encode('ascii') + b'\n')
+        self.process.stdin.flush()
+        # Cabecera "<sha> <tipo> <tamaño>" o "<sha> missing"
+        header = self.process.stdout.readline().split()
+        if len(header) != 3:
+            raise ValueError(f"Blob no encontrado: {sha}")
+        size = int(header[2])
+        data = self.process.stdout.read(size)
+        self.process.stdout.read(1)
+        if len(data) != size:
+            raise OSError("git cat-file terminó antes de tiempo")
+        return data
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+def blob_text(data):
+    """Texto de un blob con saltos de línea universales, como al abrir el archivo"""
+    text = data.decode('utf-8', errors='ignore')
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+def blob_lines(text):
+    """Líneas no vacías, igual que filecompare.read_lines"""
+    return [line for line in text.split('\n') if line.strip()]
+
+def compare_revisions(repo, rev1, rev2, output_dir, file_extensions=None, exclude=(),
+                      paths=None, workers=1, detect_renames=True, result_cache=True,
+                      cache_max_bytes=filecompare.RESULT_CACHE_MAX_BYTES, state_dir=None,
+                      sql_canonical=False, report_path=None, **render_options):
+    """
+    Compara dos revisiones de un repositorio git sin extraerlas:
+    - git diff --raw lista los archivos cambiados (paths lo restringe) y ya
+      descarta los que tienen el mismo blob; renombrados o cambios de modo
+      con el mismo SHA se omiten sin leer nada
+    - Los blobs se leen por un único proceso git cat-file --batch y pasan al
+      mismo pipeline de diferencias y renderizado que compare_directories
+      (render_options son las opciones de filecompare.make_options)
+    - Los SHA de git sirven de clave del caché de resultados y del caché de
+      formas canónicas (sql_canonical)
+    - Los archivos borrados se omiten, como en compare_directories
+    Devuelve la lista de salidas generadas.
+    """
+    renderer = render_options.get('renderer', 'png')
+    if renderer not in filecompare.RENDERERS:
+        raise ValueError(f"Formato de salida desconocido: {renderer}")
+    if not os.path.isdir(repo):
+        raise ValueError(f"El repositorio no existe: {repo}")
+    extension = filecompare.RENDERERS[renderer][0]
+
+    output_dir = os.path.normpath(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    state_dir = os.path.normpath(state_dir or os.path.join(output_dir, filecompare.STATE_DIRNAME))
+    workers = workers or os.cpu_count() or 1
+
+    if file_extensions:
+        file_extensions = [ext.lower() if ext.startswith('.') else f".{ext.lower()}"
+                           for ext in file_extensions]
+        print(f"\nProcesando solo archivos con extensiones: {', '.join(file_extensions)}")
+
+    cache = None
+    if result_cache:
+        cache = filecompare.ResultCache(os.path.join(state_dir, 'results'), cache_max_bytes)
+    canonical = filecompare.SqlCanonicalCache(state_dir) if sql_canonical else None
+    options = filecompare.make_options(result_cache=cache, **render_options)
+    report = filecompare.RunReport()
+
+    with report.run.phase('listado'):
+        changes = changed_files(repo, rev1, rev2, paths, detect_renames)
+    print(f"\n{len(changes)} archivos cambiados entre {rev1} y {rev2}")
+
+    def selected(path):
+        if file_extensions and os.path.splitext(path)[1].lower() not in file_extensions:
+            return False
+        parts = path.split('/')
+        return not any(filecompare.is_excluded('/'.join(parts[:i]), True, exclude)
+                       for i in range(1, len(parts))) and \
+            not filecompare.is_excluded(path, False, exclude)
+
+    def output_stem(path):
+        return os.path.join(output_dir, *os.path.splitext(path)[0].split('/'))
+
+    reader = GitBlobReader(repo)
+
+    def read(sha):
+        with report.run.phase('blobs'):
+            return blob_text(reader.read(sha))
+
+    def tasks():
+        for status, old_path, new_path, old_sha, new_sha in changes:
+            if status == 'D' or not selected(new_path):
+                continue
+
+            if status == 'A':
+                message = f"\nProcesando NUEVO archivo: {new_path}"
+                try:
+                    lines = blob_lines(read(new_sha))
+                except (OSError, ValueError) as e:
+                    yield f"{message}\nError procesando nuevo archivo {new_path}: {str(e)}", None, None
+                    continue
+                cache_key = cache.key(None, new_sha, options) if cache is not None else None
+                yield message, filecompare._instrumented_task, (
+                    filecompare.render_new_lines, new_path,
+                    (lines, output_stem(new_path) + f"_NUEVO{extension}", new_path, options,
+                     cache_key))
+                continue
+
+            if status in PAIRED_STATUSES:
+                message = f"\nAnalizando RENOMBRADO: {old_path} -> {new_path}"
+            else:
+                message = f"\nAnalizando: {new_path}"
+            # Mismo blob (renombrado puro o solo cambio de modo): nada que leer
+            if old_sha == new_sha:
+                report.run.count('identicos')
+                yield f"{message}\n  Mismo contenido (blob {new_sha[:10]}) - omitiendo", None, None
+                continue
+
+            try:
+                text1, text2 = read(old_sha), read(new_sha)
+                if (canonical is not None and
+                        os.path.splitext(new_path)[1].lower() in filecompare.SQL_CANONICAL_EXTENSIONS):
+                    with report.run.phase('canonico'):
+                        cosmetic = (canonical.digest(None, old_sha, lambda: text1) ==
+                                    canonical.digest(None, new_sha, lambda: text2))
+                    if cosmetic:
+                        report.run.count('cosmeticos')
+                        report.cosmetic.append(new_path)
+                        yield f"{message}\n  Solo cambios cosméticos SQL - omitiendo", None, None
+                        continue
+            except (OSError, ValueError) as e:
+                yield f"{message}\nError procesando {new_path}: {str(e)}", None, None
+                continue
+            cache_key = cache.key(old_sha, new_sha, options) if cache is not None else None
+            yield message, filecompare._instrumented_task, (
+                filecompare.compare_lines, new_path,
+                (blob_lines(text1), blob_lines(text2), output_stem(new_path) + extension,
+                 new_path, options, cache_key))
+
+    generated = []
+    try:
+        for result in filecompare.run_tasks(tasks(), workers):
+            # Un proceso de trabajo caído devuelve una lista vacía sin métricas
+            images, stats = result if isinstance(result, tuple) else (result, None)
+            generated.extend(images)
+            if stats is not None:
+                report.add(stats)
+    finally:
+        reader.close()
+
+    if canonical is not None:
+        try:
+            canonical.save()
+        except OSError as e:
+            print(f"Error guardando formas canónicas {canonical.path}: {str(e)}")
+    if cache is not None:
+        try:
+            cache.evict()
+        except OSError as e:
+            print(f"Error recortando caché {cache.cache_dir}: {str(e)}")
+
+    if report.cosmetic:
+        print(f"\nArchivos .sql con solo cambios cosméticos ({len(report.cosmetic)}):")
+        for path in report.cosmetic:
+            print(f"  {path}")
+    if report_path:
+        report.write(report_path)
+        print(f"\nReporte de ejecución: {report_path}")
+    return generated
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Compara dos revisiones de un repositorio git sin extraerlas')
+    parser.add_argument('repo', help='Repositorio git local')
+    parser.add_argument('rev1', help='Revisión base (commit, rama o etiqueta)')
+    parser.add_argument('rev2', help='Revisión modificada')
+    parser.add_argument('output_dir', nargs='?', default='evidencia_construccion',
+                       help='Directorio de salida (por defecto: evidencia_construccion)')
+    parser.add_argument('--paths', nargs='+',
+                       help='Comparar solo estas rutas del repositorio')
+    parser.add_argument('--context-lines', type=int, default=2,
+                       help='Líneas de contexto alrededor de cada cambio')
+    parser.add_argument('--max-gap', type=int, default=5,
+                       help='Distancia máxima para agrupar cambios en un mismo hunk')
+    parser.add_argument('--split-images', action='store_true',
+                       help='Dividir las imágenes que superen --max-height')
+    parser.add_argument('--max-height', type=int, default=1000,
+                       help='Altura máxima de cada imagen al dividir')
+    parser.add_argument('--extensions', nargs='+', dest='file_extensions',
+                       help='Procesar solo estas extensiones (ej: .py .cs)')
+    parser.add_argument('--exclude', nargs='+', default=list(filecompare.DEFAULT_EXCLUDES),
+                       help='Patrones estilo .gitignore a excluir (por defecto: .git/ bin/ obj/)')
+    parser.add_argument('--engine', choices=filecompare.DIFF_ENGINES, default='myers',
+                       dest='diff_engine', help='Motor de diferencias (por defecto: myers)')
+    parser.add_argument('--format', choices=sorted(filecompare.RENDERERS), default='png',
+                       dest='renderer', help='Formato de salida (por defecto: png)')
+    parser.add_argument('--workers', type=int, default=1,
+                       help='Procesos en paralelo (0 = todos los núcleos)')
+    parser.add_argument('--no-renames', action='store_false', dest='detect_renames',
+                       help='No emparejar archivos renombrados (git diff -M)')
+    parser.add_argument('--no-cache', action='store_false', dest='result_cache',
+                       help='No reutilizar ni guardar resultados en caché')
+    parser.add_argument('--sql-canonical', action='store_true',
+                       help='Omitir los .sql que solo cambian en JOIN/NOLOCK, mayúsculas o espacios')
+    parser.add_argument('--highlight-partial', choices=sorted(filecompare.HIGHLIGHT_MODES),
+                       help='Resaltar dentro de cada línea lo cambiado, por palabras o caracteres')
+    parser.add_argument('--report', dest='report_path',
+                       help='Escribir métricas por archivo y fase (.json o .csv)')
+
+    args = parser.parse_args()
+
+    try:
+        compare_revisions(
+            args.repo, args.rev1, args.rev2, args.output_dir,
+            file_extensions=args.file_extensions,
+            exclude=args.exclude,
+            paths=args.paths,
+            workers=args.workers,
+            detect_renames=args.detect_renames,
+            result_cache=args.result_cache,
+            sql_canonical=args.sql_canonical,
+            report_path=args.report_path,
+            context_lines=args.context_lines,
+            max_gap=args.max_gap,
+            split_images=int(args.split_images),
+            max_height=args.max_height,
+            highlight_partial=filecompare.HIGHLIGHT_MODES.get(args.highlight_partial, 0),
+            diff_engine=args.diff_engine,
+            renderer=args.renderer
+        )
+    except ValueError as e:
+        print(f"Error: {str(e)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
+
+# Ejemplo de uso:
+# python gitcompare.py /ruta/al/repo v1.0 HEAD evidencia_construccion --extensions .cs .sql
@@ -1,7 +1,14 @@
+import os
 import re
 import sys
+import json
+import time
+import hashlib
 from pathlib import Path
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
 from colorama import init, Fore, Style
+from sql_normalizer import StatementCache, STATEMENT_CACHE_SIZE, replace_file, split_statements
 
 # Inicializar colorama para colores en terminal
 init()
@@ -16,14 +23,22 @@ def print_colored(status, message):
     }
     print(f"{colors[status]}{message}{Style.RESET_ALL}")
 
+# Directorio (fuera del árbol SQL) con un estado por directorio procesado:
+# (mtime, tamaño, hash de la salida normalizada) de cada archivo
+STATE_DIR = os.path.join(os.path.expanduser('~'), '.sql_modif')
+# Subir al cambiar las reglas de normalización: invalida los estados guardados
+STATE_VERSION = 2
+# Un archivo modificado hace menos de esto puede cambiar sin alterar su mtime
+STATE_RACY_NS = 2_000_000_000
+
+CASE_KEYWORDS = ['SELECT', 'FROM', 'JOIN', 'INNER', 'LEFT', 'RIGHT', 'FULL', 'OUTER',
+                 'WHERE', 'HAVING', 'EXISTS', 'WITH', 'NOLOCK', 'UPDATE', 'DELETE', 'AS']
+CASE_PATTERN = re.compile(r'\b(?:' + '|'.join(CASE_KEYWORDS) + r')\b', re.IGNORECASE)
+
 def normalize_case(sql_content):
     """Normaliza palabras clave SQL a mayúsculas"""
-    keywords = ['SELECT', 'FROM', 'JOIN', 'INNER', 'LEFT', 'RIGHT', 'FULL', 'OUTER', 
-                'WHERE', 'HAVING', 'EXISTS', 'WITH', 'NOLOCK', 'UPDATE', 'DELETE', 'AS']
-    
-    for keyword in keywords:
-        sql_content = re.sub(r'\b' + keyword + r'\b', keyword, sql_content, flags=re.IGNORECASE)
-    return sql_content
+    # Una sola pasada para todas las palabras clave
+    return CASE_PATTERN.sub(lambda m: m.group().upper(), sql_content)
 
 def normalize_joins(sql_content):
     """Reemplaza JOIN puros por INNER JOIN"""
@@ -61,37 +76,176 @@ def add_nolock_hints(sql_content, is_main_query=True):
     
     return table_ref_pattern.sub(add_hint, sql_content)
 
-def process_sql_file(file_path):
-    """Procesa un archivo SQL y devuelve si fue modificado"""
+def normalize_sql(content):
+    """Aplica todos los pasos de normalización a una sentencia"""
+    # Paso 1: Normalizar JOINs
+    step1 = normalize_joins(content)
+    
+    # Paso 2: Procesar subconsultas
+    step2 = add_nolock_to_subqueries(step1)
+    
+    # Paso 3: Procesar consulta principal
+    step3 = add_nolock_hints(step2)
+    
+    # Paso 4: Normalizar mayúsculas
+    return normalize_case(step3)
+
+def normalize_script(content, cache=None):
+    """
+    Normaliza un script sentencia a sentencia (';' y GO), con o sin cache:
+    las reglas se anclan al inicio del texto (UPDATE/DELETE) y las
+    subconsultas no deben cruzar de una sentencia a la siguiente, así que
+    ambos caminos tienen que ver los mismos trozos para dar el mismo resultado.
+    """
+    if cache is not None:
+        return cache.normalize(content, normalize_sql, f"sql_modif:{STATE_VERSION}")
+    return ''.join(normalize_sql(chunk) for chunk in split_statements(content))
+
+# Memoria de sentencias de cada proceso de trabajo (ver _init_worker)
+_worker_cache = None
+
+def content_digest(content):
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+
+def normalize_file(file_path, normalized_digest=None, cache=None, check=False, backup=False):
+    """
+    Normaliza un archivo y devuelve (estado, hash de la salida normalizada).
+    Si el contenido coincide con normalized_digest ya está normalizado y no
+    se vuelve a analizar. Con cache (StatementCache) se reutilizan las
+    sentencias ya vistas. Con check no se escribe nada y
+    'modified' indica que el archivo cambiaría; con backup el original se
+    conserva como .bak.
+    """
     try:
         with open(file_path, 'r', encoding='utf-8') as file:
             original_content = file.read()
         
-        # Paso 1: Normalizar JOINs
-        step1 = normalize_joins(original_content)
-        
-        # Paso 2: Procesar subconsultas
-        step2 = add_nolock_to_subqueries(step1)
-        
-        # Paso 3: Procesar consulta principal
-        step3 = add_nolock_hints(step2)
+        digest = content_digest(original_content)
+        if digest == normalized_digest:
+            return 'unchanged', digest
         
-        # Paso 4: Normalizar mayúsculas
-        final_content = normalize_case(step3)
+        final_content = normalize_script(original_content, cache)
         
         if final_content == original_content:
-            return 'unchanged'
+            return 'unchanged', digest
         
-        with open(file_path, 'w', encoding='utf-8') as file:
-            file.write(final_content)
-        return 'modified'
+        if check:
+            return 'modified', None
+        
+        replace_file(file_path, final_content, f"{file_path}.bak" if backup else None)
+        return 'modified', content_digest(final_content)
         
     except Exception as e:
         print_colored('error', f"Error procesando {file_path}: {str(e)}")
-        return 'error'
+        return 'error', None
+
+def _init_worker(memo_size, memo_path):
+    global _worker_cache
+    _worker_cache = StatementCache(memo_size, memo_path)
+
+def _normalize_task(file_path, normalized_digest, check=False, backup=False, cache=None):
+    """
+    Normaliza un archivo y devuelve (estado, hash, mtime, tamaño, sentencias
+    nuevas). Las sentencias nuevas solo se devuelven desde un proceso de
+    trabajo, para que el proceso principal las incorpore a su memoria.
+    """
+    in_worker = cache is None and _worker_cache is not None
+    status, digest = normalize_file(file_path, normalized_digest, cache or _worker_cache,
+                                    check, backup)
+    added = _worker_cache.take_added() if in_worker else {}
+    if status == 'error':
+        return status, None, None, None, added
+    try:
+        st = os.stat(file_path)
+    except OSError as e:
+        print_colored('error', f"Error procesando {file_path}: {str(e)}")
+        return 'error', None, None, None, added
+    return status, digest, st.st_mtime_ns, st.st_size, added
+
+def default_state_path(root_dir, state_dir=None):
+    """Archivo de estado de root_dir dentro de state_dir (por defecto STATE_DIR)"""
+    directory = os.path.abspath(root_dir)
+    key = hashlib.blake2b(directory.encode('utf-8'), digest_size=8).hexdigest()
+    return os.path.join(state_dir or STATE_DIR, f"state_{key}.json")
 
-def process_directory(root_dir):
-    """Procesa recursivamente todos los archivos .sql en un directorio"""
+class NormalizationState:
+    """
+    Estado persistente (mtime, tamaño, hash normalizado) de los .sql de un
+    directorio. mode identifica cómo se normalizó ('memo' o 'full'): un
+    estado guardado con otro modo o versión se descarta.
+    """
+
+    def __init__(self, path, mode='full'):
+        self.path = path
+        self.mode = mode
+        self.entries = {}
+        self.dirty = False
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == STATE_VERSION and data.get('mode', 'full') == mode:
+                self.entries = data.get('files', {})
+        except (OSError, ValueError):
+            pass
+
+    def is_normalized(self, rel_path, st):
+        """True si el archivo no cambió desde que quedó normalizado"""
+        entry = self.entries.get(rel_path)
+        return bool(entry) and entry[0] == st.st_mtime_ns and entry[1] == st.st_size
+
+    def digest(self, rel_path):
+        entry = self.entries.get(rel_path)
+        return entry[2] if entry else None
+
+    def update(self, rel_path, mtime_ns, size, digest):
+        if digest is None:
+            if self.entries.pop(rel_path, None) is not None:
+                self.dirty = True
+            return
+        if time.time_ns() - mtime_ns <= STATE_RACY_NS:
+            # Demasiado reciente para fiarse del mtime: solo se conserva el hash
+            mtime_ns = None
+        entry = [mtime_ns, size, digest]
+        if self.entries.get(rel_path) != entry:
+            self.entries[rel_path] = entry
+            self.dirty = True
+
+    def prune(self, rel_paths):
+        """Olvida los archivos que ya no existen"""
+        for rel_path in set(self.entries) - set(rel_paths):
+            del self.entries[rel_path]
+            self.dirty = True
+
+    def save(self):
+        """Escribe el estado de forma atómica si hubo cambios"""
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': STATE_VERSION, 'mode': self.mode, 'files': self.entries}, f)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+def process_directory(root_dir, workers=1, use_state=True, state_path=None, state_dir=None,
+                      memo=False, memo_path=None, memo_size=STATEMENT_CACHE_SIZE,
+                      check=False, backup=False, cache=None):
+    """
+    Procesa recursivamente todos los archivos .sql en un directorio.
+    - workers > 1 reparte los archivos en un pool de procesos (0 = todos los núcleos)
+    - use_state guarda (mtime, tamaño, hash normalizado) de cada archivo en
+      state_path (por defecto un archivo por directorio en state_dir, o en
+      STATE_DIR, nunca dentro del árbol procesado) y en la
+      siguiente ejecución omite sin leerlos los que no cambiaron; si solo
+      cambió el mtime se compara el hash antes de volver a normalizar
+    - memo divide los scripts en sentencias (';' y GO) y memoriza cada una
+      normalizada en una LRU de memo_size entradas, guardada en memo_path si
+      se indica (la salida es la misma que sin memo). cache
+      permite pasar una StatementCache ya creada (p. ej. la de watch.py)
+    - check solo informa qué archivos cambiarían: no escribe archivos, estado
+      ni memoria; backup conserva cada original modificado como .bak
+    Devuelve el resumen {'modified', 'unchanged', 'skipped', 'error'}
+    """
     root_path = Path(root_dir)
     if not root_path.exists():
         print_colored('error', f"El directorio {root_dir} no existe")
@@ -99,31 +253,109 @@ def process_directory(root_dir):
     
     print_colored('info', f"\nAnalizando directorio: {root_path.resolve()}")
     
-    modified_count = 0
-    unchanged_count = 0
-    error_count = 0
+    if cache is None and (memo or memo_path):
+        cache = StatementCache(memo_size, memo_path)
+    state = None
+    if use_state:
+        state = NormalizationState(str(state_path or default_state_path(root_path, state_dir)),
+                                   'full' if cache is None else 'memo')
     
+    counts = {'modified': 0, 'unchanged': 0, 'skipped': 0, 'error': 0}
+    pending = []
+    rel_paths = []
     for sql_file in root_path.rglob('*.sql'):
-        result = process_sql_file(sql_file)
-        
-        if result == 'modified':
-            print_colored('modified', f"MODIFICADO: {sql_file}")
-            modified_count += 1
-        elif result == 'unchanged':
+        rel_path = sql_file.relative_to(root_path).as_posix()
+        rel_paths.append(rel_path)
+        if state is not None:
+            try:
+                if state.is_normalized(rel_path, sql_file.stat()):
+                    print_colored('unchanged', f"SIN CAMBIOS: {sql_file}")
+                    counts['unchanged'] += 1
+                    counts['skipped'] += 1
+                    continue
+            except OSError:
+                pass
+        pending.append((sql_file, rel_path))
+    
+    digests = [state.digest(rel_path) if state else None for _, rel_path in pending]
+    paths = [str(sql_file) for sql_file, _ in pending]
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    if workers > 1 and len(pending) > 1:
+        initargs = (cache.max_entries, cache.path) if cache is not None else None
+        with ProcessPoolExecutor(max_workers=workers, initializer=initargs and _init_worker,
+                                 initargs=initargs or ()) as executor:
+            chunksize = max(1, len(pending) // (workers * 8))
+            results = list(executor.map(_normalize_task, paths, digests, repeat(check),
+                                        repeat(backup), chunksize=chunksize))
+    else:
+        results = map(_normalize_task, paths, digests, repeat(check), repeat(backup),
+                      repeat(cache))
+    
+    for (sql_file, rel_path), (status, digest, mtime_ns, size, added) in zip(pending, results):
+        if status == 'modified':
+            print_colored('modified', f"{'CAMBIARÍA' if check else 'MODIFICADO'}: {sql_file}")
+        elif status == 'unchanged':
             print_colored('unchanged', f"SIN CAMBIOS: {sql_file}")
-            unchanged_count += 1
-        else:
-            error_count += 1
+        counts[status] += 1
+        if state is not None and not check:
+            state.update(rel_path, mtime_ns, size, digest)
+        if cache is not None:
+            cache.update(added)
+    
+    if check:
+        state = cache = None
+    if state is not None:
+        state.prune(rel_paths)
+        try:
+            state.save()
+        except OSError as e:
+            print_colored('error', f"Error guardando estado {state.path}: {str(e)}")
+    if cache is not None:
+        try:
+            cache.save()
+        except OSError as e:
+            print_colored('error', f"Error guardando memoria de sentencias {cache.path}: {str(e)}")
     
     print_colored('info', f"\nResumen:")
-    print_colored('modified', f"Archivos modificados: {modified_count}")
-    print_colored('unchanged', f"Archivos sin cambios: {unchanged_count}")
-    print_colored('error', f"Archivos con errores: {error_count}")
+    print_colored('modified', f"Archivos {'a modificar' if check else 'modificados'}: {counts['modified']}")
+    print_colored('unchanged', f"Archivos sin cambios: {counts['unchanged']}"
+                  f" ({counts['skipped']} omitidos por estado)")
+    print_colored('error', f"Archivos con errores: {counts['error']}")
+    return counts
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("USO: python sql_normalizer.py <directorio>")
-        sys.exit(1)
+def main():
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Normaliza recursivamente los .sql de un directorio')
+    parser.add_argument('directory', help='Directorio a procesar')
+    parser.add_argument('--workers', type=int, default=1,
+                       help='Procesos en paralelo (0 = todos los núcleos)')
+    parser.add_argument('--no-state', action='store_false', dest='use_state',
+                       help='No usar ni guardar el estado incremental')
+    parser.add_argument('--state-dir',
+                       help=f'Directorio del estado incremental (por defecto {STATE_DIR})')
+    parser.add_argument('--state-file', help='Ruta alternativa del archivo de estado')
+    parser.add_argument('--check', action='store_true',
+                       help='Solo informar qué archivos cambiarían, sin escribir (sale con código 1 si hay alguno)')
+    parser.add_argument('--backup', action='store_true',
+                       help='Conservar cada archivo modificado como .bak (enlace, sin copiar bytes)')
+    parser.add_argument('--memo', action='store_true',
+                       help='Memorizar la normalización por sentencia (scripts con partes repetidas)')
+    parser.add_argument('--memo-file',
+                       help='Guardar la memoria de sentencias en este archivo entre ejecuciones')
+    parser.add_argument('--memo-size', type=int, default=STATEMENT_CACHE_SIZE,
+                       help='Máximo de sentencias memorizadas')
     
-    target_dir = sys.argv[1]
-    process_directory(target_dir)
\ No newline at end of file
+    args = parser.parse_args()
+    
+    counts = process_directory(args.directory, workers=args.workers, use_state=args.use_state,
+                               state_path=args.state_file, state_dir=args.state_dir,
+                               memo=args.memo,
+                               memo_path=args.memo_file, memo_size=args.memo_size,
+                               check=args.check, backup=args.backup)
+    if args.check and counts and counts['modified']:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,101 +1,463 @@
+import os
 import re
+import sys
+import stat
+import json
+import hashlib
+import tempfile
+from collections import OrderedDict
 from pathlib import Path
 from datetime import datetime
 
+# Patrones de comentarios y literales compartidos por el tokenizador y el explorador
+_COMMENT = r"--[^\n]*|/\*[\s\S]*?(?:\*/|$)"
+_STRING = r"[Nn]?'(?:[^']|'')*'?"
+_IDENT = r'\[(?:[^\]]|\]\])*\]?|"(?:[^"]|"")*"?'
+
+# Tokenizador fino: los espacios se absorben delante de cada token y el orden de
+# las alternativas importa (comentarios y literales antes que palabras)
+TOKEN_PATTERN = re.compile(rf"""
+    \s*(?:
+      (?P<comment>{_COMMENT})
+    | (?P<string>{_STRING})
+    | (?P<ident>{_IDENT})
+    | (?P<word>[^\W\d][\w@#$]*|[@#][\w@#$]*)
+    | (?P<other>\d[\w.]*|[^\s\w'"\[@#(),;.\-/]+|.)
+    )
+""", re.VERBOSE)
+# Solo espacios y comentarios entre dos tokens
+BLANK_PATTERN = re.compile(rf"(?:\s+|{_COMMENT})*")
+
+# Palabras que pueden ir justo antes de JOIN sin que falte INNER
+JOIN_QUALIFIERS = {'INNER', 'LEFT', 'RIGHT', 'FULL', 'CROSS', 'OUTER',
+                   'LOOP', 'MERGE', 'HASH', 'REMOTE'}
+# Sentencias de escritura: sus tablas no llevan NOLOCK
+WRITE_STATEMENTS = {'UPDATE', 'DELETE', 'INSERT', 'MERGE', 'TRUNCATE'}
+# Palabras que inician una sentencia nueva a profundidad 0 (END no: cierra bloques)
+STATEMENT_STARTERS = WRITE_STATEMENTS | {
+    'SELECT', 'CREATE', 'ALTER', 'DROP', 'DECLARE', 'SET', 'IF', 'ELSE', 'WHILE',
+    'BEGIN', 'RETURN', 'EXEC', 'EXECUTE', 'PRINT', 'USE', 'COMMIT', 'ROLLBACK',
+    'RAISERROR', 'THROW', 'GO'}
+SET_OPERATORS = {'UNION', 'ALL', 'EXCEPT', 'INTERSECT'}
+# Palabras reservadas que nunca son alias de tabla
+RESERVED_WORDS = JOIN_QUALIFIERS | STATEMENT_STARTERS | SET_OPERATORS | {
+    'JOIN', 'ON', 'WHERE', 'GROUP', 'ORDER', 'HAVING', 'WITH', 'AS', 'FROM', 'INTO',
+    'VALUES', 'OUTPUT', 'OPTION', 'FOR', 'APPLY', 'PIVOT', 'UNPIVOT', 'TABLESAMPLE',
+    'WHEN', 'THEN', 'END', 'USING', 'AND', 'OR', 'NOT', 'IN', 'IS', 'NULL', 'CASE',
+    'BY', 'TOP', 'DISTINCT', 'OFFSET', 'FETCH'}
+NOLOCK_HINT = ' WITH (NOLOCK)'
+
+def _keyword_alternation(words):
+    """Alternativa de regex agrupada por primera letra: mucho más rápida que una lista plana"""
+    groups = {}
+    for word in words:
+        groups.setdefault(word[0], []).append(word[1:])
+    return '|'.join(first + '(?:' + '|'.join(sorted(rests, key=len, reverse=True)) + ')'
+                    for first, rests in sorted(groups.items()))
+
+# Explorador grueso: solo se detiene en comentarios, literales, paréntesis, ';'
+# y las palabras clave que cambian el contexto; el resto lo salta el motor de re
+SCAN_PATTERN = re.compile(rf"""
+      (?P<comment>{_COMMENT})
+    | (?P<string>{_STRING})
+    | (?P<ident>{_IDENT})
+    | (?<![\w@#$])(?P<word>{_keyword_alternation(
+        JOIN_QUALIFIERS | STATEMENT_STARTERS | SET_OPERATORS |
+        {'FROM', 'JOIN', 'CASE', 'END'})})(?![\w@#$])
+    | (?P<other>[();])
+""", re.VERBOSE | re.IGNORECASE)
+
+def iter_sql_tokens(content, pos=0):
+    """Tokens significativos (tipo, texto, inicio, fin) desde pos, sin espacios ni comentarios"""
+    match = TOKEN_PATTERN.match
+    while True:
+        m = match(content, pos)
+        if m is None:
+            return
+        pos = m.end()
+        kind = m.lastgroup
+        if kind != 'comment':
+            yield kind, m.group(kind), m.start(kind), pos
+
+def _ident_name(text):
+    """Nombre de un identificador sin corchetes ni comillas, en mayúsculas"""
+    if text[:1] in '["':
+        text = text[1:-1]
+    return text.upper()
+
+def _table_end(content, pos):
+    """
+    Fin (posición en content) de la referencia de tabla que sigue a FROM/JOIN,
+    incluido su alias, o None si no debe llevar NOLOCK: tablas temporales,
+    variables, tempdb, funciones, tablas derivadas y tablas con hint propio.
+    """
+    # Basta con los tokens de a.b.c AS alias WITH (
+    tokens = []
+    match = TOKEN_PATTERN.match
+    while len(tokens) < 10:
+        m = match(content, pos)
+        if m is None:
+            break
+        pos = m.end()
+        if m.lastgroup != 'comment':
+            tokens.append(m)
+    count = len(tokens)
+
+    def kind_at(i):
+        return tokens[i].lastgroup if i < count else None
+
+    def text_at(i):
+        return tokens[i].group(tokens[i].lastgroup) if i < count else ''
+
+    kind, text = kind_at(0), text_at(0)
+    if kind not in ('word', 'ident') or text[0] in '#@':
+        return None
+    if kind == 'word' and text.upper() in RESERVED_WORDS:
+        return None
+    first = _ident_name(text)
+    # Nombre calificado: a.b.c o a..c
+    i = 0
+    while text_at(i + 1) == '.':
+        i += 1
+        if kind_at(i + 1) in ('word', 'ident'):
+            i += 1
+    if first == 'TEMPDB' or text_at(i + 1) == '(':
+        return None
+    # Alias opcional
+    kind, text = kind_at(i + 1), text_at(i + 1).upper()
+    if text == 'AS' and i + 2 < count:
+        i += 2
+    elif kind == 'ident' or (kind == 'word' and text not in RESERVED_WORDS and text[0] not in '#@'):
+        i += 1
+    # Hint existente
+    if text_at(i + 1).upper() == 'WITH' and text_at(i + 2) == '(':
+        return None
+    return tokens[i].end()
+
+def _adjacent(content, previous, previous_end, start):
+    """La palabra clave anterior si entre ella y start solo hay espacios o comentarios"""
+    if previous and BLANK_PATTERN.fullmatch(content, previous_end, start):
+        return previous
+    return None
+
+def _next_word(content, pos):
+    token = next(iter_sql_tokens(content, pos), None)
+    return token[1].upper() if token is not None and token[0] == 'word' else None
+
+def rewrite_sql(content, normalize_joins=True, add_nolock=True):
+    """
+    Aplica en un solo recorrido lineal las reglas de JOIN y NOLOCK.
+    Comentarios, literales e identificadores entre corchetes no se tocan y el
+    contexto de sentencia (lectura o escritura) se sigue de forma incremental,
+    por lo que las cláusulas FROM/JOIN pueden ocupar varias líneas. Un ELSE
+    dentro de CASE ... END no inicia sentencia, así que el destino de un
+    UPDATE con CASE en el SET sigue sin NOLOCK:
+
+    >>> print(rewrite_sql("UPDATE t SET a = CASE WHEN b = 1 THEN 1 ELSE 0 END "
+    ...                   "FROM dbo.t JOIN dbo.u ON u.id = t.id"))
+    UPDATE t SET a = CASE WHEN b = 1 THEN 1 ELSE 0 END FROM dbo.t INNER JOIN dbo.u ON u.id = t.id
+    >>> print(rewrite_sql("IF @x = 1 DELETE FROM dbo.t ELSE SELECT a FROM dbo.t"))
+    IF @x = 1 DELETE FROM dbo.t ELSE SELECT a FROM dbo.t WITH (NOLOCK)
+    """
+    inserts = []   # (posición en content, texto a insertar), en orden
+    depth = 0
+    case_depth = 0   # CASE abiertos: su END no cierra un bloque BEGIN
+    writing = False
+    statement = None
+    previous, previous_end = None, 0
+
+    for m in SCAN_PATTERN.finditer(content):
+        kind = m.lastgroup
+        if kind != 'word':
+            if kind == 'other':
+                text = m.group()
+                if text == '(':
+                    depth += 1
+                elif text == ')':
+                    depth = max(depth - 1, 0)
+                else:
+                    depth, case_depth, writing, statement = 0, 0, False, None
+            continue
+
+        upper = m.group().upper()
+        start = m.start()
+        if upper in ('FROM', 'JOIN'):
+            if (upper == 'JOIN' and normalize_joins and
+                    _adjacent(content, previous, previous_end, start) not in JOIN_QUALIFIERS):
+                inserts.append((start, 'INNER '))
+            if add_nolock and not writing:
+                end = _table_end(content, m.end())
+                if end is not None:
+                    inserts.append((end, NOLOCK_HINT))
+        elif upper == 'GO':
+            depth, case_depth, writing, statement = 0, 0, False, None
+        elif upper == 'CASE':
+            case_depth += 1
+        elif upper == 'END':
+            case_depth = max(case_depth - 1, 0)
+        elif upper == 'ELSE' and case_depth:
+            pass   # rama de CASE, no el ELSE de un IF
+        elif depth == 0 and upper in STATEMENT_STARTERS:
+            if upper == 'MERGE' and _next_word(content, m.end()) == 'JOIN':
+                pass   # hint de JOIN (INNER MERGE JOIN), no una sentencia
+            elif upper == 'SELECT':
+                # INSERT ... SELECT y los operadores de conjunto siguen la sentencia
+                if statement == 'INSERT':
+                    statement = 'INSERT SELECT'
+                elif _adjacent(content, previous, previous_end, start) not in SET_OPERATORS:
+                    writing, statement = False, 'SELECT'
+            elif upper == 'SET' and statement in ('UPDATE', 'MERGE'):
+                pass
+            else:
+                writing, statement = upper in WRITE_STATEMENTS, upper
+        previous, previous_end = upper, m.end()
+
+    if not inserts:
+        return content
+    parts = []
+    last = 0
+    for offset, text in inserts:
+        parts.append(content[last:offset])
+        parts.append(text)
+        last = offset
+    parts.append(content[last:])
+    return ''.join(parts)
+
+# Fin de sentencia o de lote: ';' o GO fuera de comentarios y literales
+SPLIT_PATTERN = re.compile(rf"""
+      {_COMMENT}
+    | {_STRING}
+    | {_IDENT}
+    | (?P<end>;|(?<![\w@#$])GO(?![\w@#$]))
+""", re.VERBOSE | re.IGNORECASE)
+
+# Sentencias normalizadas que se recuerdan por defecto
+STATEMENT_CACHE_SIZE = 20000
+# Subir al cambiar las reglas: invalida las cachés persistidas
+STATEMENT_CACHE_VERSION = 2
+
+def split_statements(content):
+    """
+    Divide un script en trozos terminados en ';' o GO que concatenados
+    reproducen el original. rewrite_sql reinicia el contexto en esos puntos,
+    así que normalizar trozo a trozo da el mismo resultado que el script entero.
+    """
+    chunks = []
+    last = 0
+    for m in SPLIT_PATTERN.finditer(content):
+        if m.lastgroup == 'end':
+            chunks.append(content[last:m.end()])
+            last = m.end()
+    if last < len(content) or not chunks:
+        chunks.append(content[last:])
+    return chunks
+
+class StatementCache:
+    """
+    Memoriza la normalización por sentencia (LRU acotada), indexada por el
+    hash BLAKE2b de (espacio de nombres, texto). Con path se carga y guarda en
+    disco para reutilizarla entre ejecuciones.
+    """
+
+    def __init__(self, max_entries=STATEMENT_CACHE_SIZE, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self.entries = OrderedDict()
+        self.added = {}
+        self.hits = 0
+        self.misses = 0
+        if path:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') == STATEMENT_CACHE_VERSION:
+                    self.entries.update(data.get('entries', []))
+            except (OSError, ValueError):
+                pass
+
+    def normalize(self, content, func, namespace=''):
+        """Aplica func a cada sentencia de content, reutilizando las ya vistas"""
+        parts = []
+        prefix = f"{namespace}\0".encode('utf-8')
+        for chunk in split_statements(content):
+            key = hashlib.blake2b(prefix + chunk.encode('utf-8'), digest_size=16).hexdigest()
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                normalized = self.entries[key]
+                self.hits += 1
+            else:
+                normalized = func(chunk)
+                # None marca las sentencias que no cambian: no se duplica el texto
+                self.add(key, None if normalized == chunk else normalized)
+                self.misses += 1
+            parts.append(chunk if normalized is None else normalized)
+        return ''.join(parts)
+
+    def add(self, key, normalized):
+        self.entries[key] = normalized
+        self.added[key] = normalized
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def update(self, entries):
+        """Incorpora entradas calculadas en otro proceso"""
+        for key, normalized in entries.items():
+            if key not in self.entries:
+                self.add(key, normalized)
+
+    def take_added(self):
+        """Entradas nuevas desde la última llamada (para devolverlas desde un proceso de trabajo)"""
+        added, self.added = self.added, {}
+        return added
+
+    def save(self):
+        """Escribe la caché de forma atómica si tiene ruta y hubo cambios"""
+        if not self.path or not self.added:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': STATEMENT_CACHE_VERSION, 'entries': list(self.entries.items())}, f)
+        os.replace(tmp_path, self.path)
+        self.added = {}
+
+def canonical_sql(content, normalizer=None):
+    """
+    Forma canónica para comparar scripts sin diferencias cosméticas: aplica
+    las reglas de SQLNormalizer (INNER en los JOIN, NOLOCK) y después pliega
+    espacios y mayúsculas. Literales, identificadores delimitados y
+    comentarios se conservan tal cual; un comentario de línea conserva el
+    salto que lo termina, para no confundir código comentado con código:
+
+    >>> comentado = canonical_sql("DELETE FROM T -- limpieza WHERE ID = 5")
+    >>> comentado == canonical_sql("DELETE FROM T -- limpieza\\nWHERE ID = 5")
+    False
+    >>> canonical_sql("select a from T") == canonical_sql("SELECT  a\\nFROM t")
+    True
+    """
+    content = (normalizer or SQLNormalizer()).normalize_content(content)
+    parts = []
+    match = TOKEN_PATTERN.match
+    pos = 0
+    while True:
+        m = match(content, pos)
+        if m is None:
+            break
+        pos = m.end()
+        kind = m.lastgroup
+        text = m.group(kind)
+        if kind in ('word', 'other'):
+            text = text.upper()
+        elif kind == 'comment':
+            text = text.rstrip()
+            if text.startswith('--'):
+                text += '\n'
+        if text.strip():
+            parts.append(text)
+    return ' '.join(parts)
+
+def replace_file(path, content, backup_path=None, encoding='utf-8'):
+    """
+    Reescribe path de forma atómica: escribe content en un temporal del mismo
+    directorio y lo mueve encima con os.replace, así una interrupción nunca
+    deja el archivo a medio escribir. Un enlace simbólico se resuelve y se
+    reescribe su destino. Con backup_path el original se conserva como copia
+    de seguridad sin copiar bytes: se enlaza (hardlink) el inodo original y,
+    si el sistema de archivos no lo permite, se renombra. La copia anterior
+    solo se descarta cuando la nueva está en su sitio, y si el reemplazo
+    falla el original vuelve a path.
+    """
+    path = os.path.realpath(os.fspath(path))
+    directory = os.path.dirname(path)
+    st = os.stat(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.",
+                                    suffix='.tmp')
+    moved = False
+    old_backup = None
+    try:
+        with os.fdopen(fd, 'w', encoding=encoding) as f:
+            f.write(content)
+        os.chmod(tmp_path, stat.S_IMODE(st.st_mode))
+        if backup_path:
+            backup_path = os.fspath(backup_path)
+            link_path = f"{backup_path}.tmp"
+            try:
+                if os.path.lexists(link_path):
+                    os.remove(link_path)
+                # El enlace se crea aparte y sustituye al .bak anterior de una vez
+                os.link(path, link_path)
+                os.replace(link_path, backup_path)
+            except OSError:
+                if os.path.lexists(link_path):
+                    os.remove(link_path)
+                if os.path.lexists(backup_path):
+                    old_backup = f"{backup_path}.old"
+                    os.replace(backup_path, old_backup)
+                os.replace(path, backup_path)
+                moved = True
+        os.replace(tmp_path, path)
+    except BaseException:
+        if moved:
+            os.replace(backup_path, path)
+        if old_backup:
+            os.replace(old_backup, backup_path)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    if old_backup:
+        try:
+            os.remove(old_backup)
+        except OSError:
+            pass
+
 class SQLNormalizer:
-    def __init__(self, normalize_joins=True, add_nolock=True):
+    def __init__(self, normalize_joins=True, add_nolock=True, statement_cache=None):
         self.normalize_joins = normalize_joins
         self.add_nolock = add_nolock
+        self.statement_cache = statement_cache
         
     def normalize_sql_joins(self, content):
         """Normaliza JOINs no calificados añadiendo INNER"""
         if not self.normalize_joins:
             return content
-            
-        join_types = {'inner', 'left', 'right', 'full', 'cross', 'loop', 'merge', 'hash'}
-        pattern = re.compile(
-            r'(\b(?:' + '|'.join(join_types) + r')\s+join\b)|(\bjoin\b)', 
-            flags=re.IGNORECASE
-        )
-        
-        def replacer(m):
-            return m.group(1) if m.group(1) else f'INNER {m.group(2)}'
-        
-        return pattern.sub(replacer, content)
+        return rewrite_sql(content, normalize_joins=True, add_nolock=False)
     
     def add_nolock_hints(self, content):
-        """Agrega WITH (NOLOCK) a tablas en FROM/JOIN de manera precisa"""
+        """Agrega WITH (NOLOCK) a tablas en FROM/JOIN fuera de sentencias de escritura"""
         if not self.add_nolock:
             return content
-            
-        # Patrón mejorado para detectar tablas con su contexto completo
-        table_pattern = re.compile(
-            r'(?P<prefix>\b(?:FROM|JOIN)\s+)'  # Palabra clave
-            r'(?P<table>(?!(?:\#|@|tempdb\.))'  # Excluir tablas temporales
-            r'(?:(?:\w+\.){0,2}\w+))'  # Nombre de tabla
-            r'(?P<alias>\s+(?:AS\s+)?\w+)?'  # Alias opcional
-            r'(?P<existing_hint>\s+WITH\s*\(\s*NOLOCK\s*\))?',  # Hint existente
-            flags=re.IGNORECASE
-        )
-        
-        # Operaciones que no deben tener NOLOCK
-        no_nolock_ops = re.compile(
-            r'\b(?:UPDATE|DELETE|INSERT|MERGE|TRUNCATE)\b',
-            flags=re.IGNORECASE
-        )
-        
-        def add_hint(match):
-            if no_nolock_ops.search(match.string[:match.start()]):
-                return match.group(0)
-                
-            # Si ya tiene el hint, no modificar
-            if match.group('existing_hint'):
-                return match.group(0)
-                
-            # Construir el reemplazo
-            replacement = match.group('prefix') + match.group('table')
-            if match.group('alias'):
-                replacement += match.group('alias')
-            replacement += ' WITH (NOLOCK)'
-            
-            return replacement
-        
-        return table_pattern.sub(add_hint, content)
+        return rewrite_sql(content, normalize_joins=False, add_nolock=True)
     
     def normalize_content(self, content):
         """Aplica todas las normalizaciones activas conservando formato"""
-        # Conservar saltos de línea y formato original
-        lines = content.splitlines()
-        normalized_lines = []
-        
-        for line in lines:
-            normalized_line = line
-            if self.normalize_joins:
-                normalized_line = self.normalize_sql_joins(normalized_line)
-            if self.add_nolock:
-                normalized_line = self.add_nolock_hints(normalized_line)
-            normalized_lines.append(normalized_line)
-        
-        return '\n'.join(normalized_lines)
+        # Una sola pasada sobre el contenido completo: saltos de línea intactos
+        if self.statement_cache is not None:
+            return self.statement_cache.normalize(
+                content, self._rewrite, f"rewrite:{self.normalize_joins:d}{self.add_nolock:d}")
+        return self._rewrite(content)
     
-    def process_file(self, file_path, create_backup=True):
-        """Procesa un archivo SQL con manejo robusto de formato"""
+    def _rewrite(self, content):
+        return rewrite_sql(content, self.normalize_joins, self.add_nolock)
+    
+    def process_file(self, file_path, create_backup=True, check=False):
+        """Procesa un archivo SQL con manejo robusto de formato; con check no escribe nada"""
         try:
             path = Path(file_path)
             original = path.read_text(encoding='utf-8')
             normalized = self.normalize_content(original)
             
             if normalized != original:
-                if create_backup:
-                    backup_path = f"{file_path}.bak"
-                    Path(backup_path).write_text(original, encoding='utf-8')
-                
-                path.write_text(normalized, encoding='utf-8')
                 changes = []
                 if self.normalize_joins:
                     changes.append("JOINs normalizados")
                 if self.add_nolock:
                     changes.append("WITH (NOLOCK) agregado")
+                if check:
+                    return f"! {path.name} requiere cambios ({', '.join(changes)})"
+                
+                backup_path = f"{file_path}.bak" if create_backup else None
+                replace_file(path, normalized, backup_path)
                 return f"✓ {path.name} modificado ({', '.join(changes)})"
             return f"→ {path.name} no requería cambios"
         
@@ -113,21 +475,47 @@ def main():
                        help='Desactivar agregado de WITH (NOLOCK)')
     parser.add_argument('--no-backup', action='store_false', dest='create_backup',
                        help='No crear archivos de backup')
+    parser.add_argument('--check', action='store_true',
+                       help='Solo informar qué archivos cambiarían, sin escribir (sale con código 1 si hay alguno)')
+    parser.add_argument('--memo', action='store_true',
+                       help='Memorizar la normalización por sentencia (útil con scripts repetidos)')
+    parser.add_argument('--memo-file',
+                       help='Guardar la memoria de sentencias en este archivo entre ejecuciones')
+    parser.add_argument('--memo-size', type=int, default=STATEMENT_CACHE_SIZE,
+                       help='Máximo de sentencias memorizadas')
     
     args = parser.parse_args()
     
+    statement_cache = None
+    if args.memo or args.memo_file:
+        statement_cache = StatementCache(args.memo_size, args.memo_file)
     normalizer = SQLNormalizer(
         normalize_joins=args.normalize_joins,
-        add_nolock=args.add_nolock
+        add_nolock=args.add_nolock,
+        statement_cache=statement_cache
     )
     
+    pending = 0
     for file_path in args.files:
         path = Path(file_path)
         if path.is_file() and path.suffix.lower() == '.sql':
-            result = normalizer.process_file(path, args.create_backup)
+            result = normalizer.process_file(path, args.create_backup, check=args.check)
+            pending += result.startswith('!')
             print(result)
         else:
             print(f"✗ {file_path} no es un archivo .sql válido")
+    
+    if statement_cache is not None:
+        print(f"Sentencias memorizadas: {statement_cache.hits} reutilizadas, "
+              f"{statement_cache.misses} normalizadas")
+        try:
+            if not args.check:
+                statement_cache.save()
+        except OSError as e:
+            print(f"✗ Error guardando {statement_cache.path}: {str(e)}")
+    
+    if args.check and pending:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,445 @@
+import os
+import sys
+import time
+import errno
+import ctypes
+import select
+import struct
+
+import filecompare
+import sql_modif
+
+# Espera sin eventos antes de procesar un lote (los editores guardan en varios pasos)
+WATCH_DEBOUNCE = 0.3
+# Intervalo del modo de sondeo cuando inotify no está disponible
+POLL_INTERVAL = 1.0
+
+# Constantes de <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+EVENT_HEADER = struct.Struct('iIII')
+
+class InotifyWatcher:
+    """Vigila árboles de directorios con inotify (Linux) mediante ctypes"""
+
+    def __init__(self, roots, recursive=True, exclude=()):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.recursive = recursive
+        self.exclude = exclude
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.watches = {}   # descriptor -> directorio
+        for root in self.roots:
+            self._watch_tree(root, root)
+
+    def _watch_tree(self, root, path):
+        """Añade vigilancia a path (y a sus subdirectorios); devuelve los archivos que contiene"""
+        wd = self._add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise OSError(err, "Límite de vigilancias inotify agotado "
+                                   "(fs.inotify.max_user_watches)")
+            return []
+        self.watches[wd] = path
+        files = []
+        try:
+            with os.scandir(path) as it:
+                entries = list(it)
+        except OSError:
+            return files
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                rel_path = os.path.relpath(entry.path, root)
+                if self.recursive and not filecompare.is_excluded(rel_path, True, self.exclude):
+                    files.extend(self._watch_tree(root, entry.path))
+            else:
+                files.append(entry.path)
+        return files
+
+    def _root_of(self, path):
+        for root in self.roots:
+            if path == root or path.startswith(root + os.sep):
+                return root
+        return None
+
+    def changes(self, timeout):
+        """Espera hasta timeout segundos y devuelve las rutas afectadas (vacío si no hubo)"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    # Se perdieron eventos: revisar los árboles completos
+                    changed.update(self.roots)
+                    continue
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                directory = self.watches.get(wd)
+                if directory is None:
+                    continue
+                path = os.path.join(directory, name) if name else directory
+                changed.add(path)
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and self.recursive:
+                    # Un directorio nuevo puede traer archivos creados antes de vigilarlo
+                    root = self._root_of(path)
+                    if root and not filecompare.is_excluded(os.path.relpath(path, root), True,
+                                                            self.exclude):
+                        changed.update(self._watch_tree(root, path))
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher:
+    """Alternativa portable: compara (mtime, tamaño) de los árboles cada intervalo"""
+
+    def __init__(self, roots, recursive=True, exclude=(), interval=POLL_INTERVAL):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.recursive = recursive
+        self.exclude = exclude
+        self.interval = interval
+        self.snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for root in self.roots:
+            for rel_path, entry in filecompare.walk_files(root, self.recursive, self.exclude):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                snapshot[entry.path] = (st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def changes(self, timeout):
+        time.sleep(min(timeout, self.interval) if timeout is not None else self.interval)
+        snapshot = self._scan()
+        changed = {path for path, sig in snapshot.items() if self.snapshot.get(path) != sig}
+        changed.update(set(self.snapshot) - set(snapshot))
+        self.snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+def create_watcher(roots, recursive=True, exclude=(), polling=False, interval=POLL_INTERVAL):
+    """inotify si está disponible (solo Linux); si no, sondeo periódico"""
+    if not polling and not sys.platform.startswith('linux'):
+        print(f"inotify no disponible en {sys.platform}; usando sondeo cada {interval}s")
+    elif not polling:
+        try:
+            return InotifyWatcher(roots, recursive, exclude)
+        except (OSError, AttributeError, TypeError) as e:
+            print(f"inotify no disponible ({str(e)}); usando sondeo cada {interval}s")
+    return PollingWatcher(roots, recursive, exclude, interval)
+
+def watch_loop(watcher, handle, debounce=WATCH_DEBOUNCE):
+    """Acumula cambios hasta debounce segundos sin eventos y los entrega a handle"""
+    pending = set()
+    deadline = None
+    try:
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            changed = watcher.changes(timeout)
+            if changed:
+                pending |= changed
+                deadline = time.monotonic() + debounce
+            elif pending and time.monotonic() >= deadline:
+                batch, pending, deadline = pending, set(), None
+                handle(batch)
+    except KeyboardInterrupt:
+        print("\nVigilancia detenida")
+    finally:
+        watcher.close()
+
+class CompareSession:
+    """
+    Estado en memoria de una comparación vigilada: hashes por archivo y
+    salidas generadas por ruta relativa, para rehacer solo el par afectado
+    y borrar exactamente las salidas que escribió.
+    """
+
+    def __init__(self, dir1, dir2, output_dir, options, recursive=False, exclude=(),
+                 file_extensions=None):
+        self.dir1 = os.path.abspath(dir1)
+        self.dir2 = os.path.abspath(dir2)
+        self.output_dir = os.path.abspath(output_dir)
+        self.options = options
+        self.recursive = recursive
+        self.exclude = exclude
+        self.file_extensions = file_extensions
+        self.extension = filecompare.RENDERERS[options['renderer']][0]
+        self.digests = {}   # ruta -> (mtime, tamaño, hash)
+        self.pairs = {}     # ruta relativa -> (hash1, hash2) ya procesados
+        self.outputs = {}   # ruta relativa -> rutas generadas para ella
+
+    def digest(self, path):
+        """Hash del archivo, o None si no existe; solo se recalcula si cambió su stat"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.digests.pop(path, None)
+            return None
+        known = self.digests.get(path)
+        if known and known[:2] == (st.st_mtime_ns, st.st_size):
+            return known[2]
+        digest = filecompare.file_digest(path)
+        self.digests[path] = (st.st_mtime_ns, st.st_size, digest)
+        return digest
+
+    def _valid(self, rel_path):
+        if not self.recursive and os.sep in rel_path:
+            return False
+        if self.file_extensions and \
+                os.path.splitext(rel_path)[1].lower() not in self.file_extensions:
+            return False
+        parts = rel_path.split(os.sep)
+        for depth in range(1, len(parts)):
+            if filecompare.is_excluded(os.sep.join(parts[:depth]), True, self.exclude):
+                return False
+        return not filecompare.is_excluded(rel_path, False, self.exclude)
+
+    def affected(self, paths):
+        """Rutas relativas afectadas por los cambios (expande directorios)"""
+        rel_paths = set()
+        for path in paths:
+            if path == self.output_dir or path.startswith(self.output_dir + os.sep):
+                continue
+            for root in (self.dir1, self.dir2):
+                if path != root and not path.startswith(root + os.sep):
+                    continue
+                rel_dir = os.path.relpath(path, root)
+                if os.path.isdir(path):
+                    prefix = '' if path == root else rel_dir + os.sep
+                    rel_paths.update(prefix + rel_path for rel_path, _ in
+                                     filecompare.walk_files(path, self.recursive, self.exclude))
+                else:
+                    rel_paths.add(rel_dir)
+                    # Un directorio borrado o movido: sus archivos conocidos también cambian
+                    rel_paths.update(known for known in self.pairs
+                                     if known.startswith(rel_dir + os.sep))
+        return {rel_path for rel_path in rel_paths if self._valid(rel_path)}
+
+    def handle(self, paths):
+        changed = False
+        for rel_path in sorted(self.affected(paths)):
+            start = time.perf_counter()
+            if self.update(rel_path):
+                changed = True
+                print(f"  Actualizado en {(time.perf_counter() - start) * 1000:.0f} ms")
+        cache = self.options['result_cache']
+        if changed and cache is not None:
+            # Un vigilante de larga duración no debe dejar crecer el caché sin límite
+            try:
+                cache.evict()
+            except OSError as e:
+                print(f"Error recortando caché {cache.cache_dir}: {str(e)}")
+
+    def update(self, rel_path):
+        """Rehace la salida de un archivo si cambió su contenido; True si hizo algo"""
+        file1_path = os.path.join(self.dir1, rel_path)
+        file2_path = os.path.join(self.dir2, rel_path)
+        digest1 = self.digest(file1_path)
+        digest2 = self.digest(file2_path)
+        previous = self.pairs.get(rel_path)
+        if previous == (digest1, digest2):
+            return False
+        if digest1 is None and digest2 is None:
+            # Temporales de editores o archivos ya borrados: nada que mostrar
+            self.pairs.pop(rel_path, None)
+            if previous is None:
+                return False
+        else:
+            self.pairs[rel_path] = (digest1, digest2)
+
+        base = os.path.join(self.output_dir, os.path.splitext(rel_path)[0])
+        remove_outputs(self.outputs.pop(rel_path, ()))
+        cache = self.options['result_cache']
+        generated = []
+        if digest2 is None:
+            print(f"\nEliminado: {rel_path}")
+        elif digest1 is None:
+            print(f"\nProcesando NUEVO archivo: {rel_path}")
+            cache_key = cache.key(None, digest2, self.options) if cache else None
+            generated = filecompare.render_new_file(file2_path, base + '_NUEVO' + self.extension,
+                                                    rel_path, self.options, cache_key)
+        elif digest1 == digest2:
+            print(f"\nAnalizando: {rel_path}\n  Archivos idénticos - omitiendo")
+        else:
+            print(f"\nAnalizando: {rel_path}")
+            cache_key = cache.key(digest1, digest2, self.options) if cache else None
+            generated = filecompare.compare_file_pair(file1_path, file2_path,
+                                                      base + self.extension, rel_path,
+                                                      self.options, cache_key)
+        if generated:
+            self.outputs[rel_path] = generated
+        return True
+
+def remove_outputs(paths):
+    """Borra las salidas generadas antes para un archivo (páginas y franjas incluidas)"""
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+class SqlSession:
+    """Renormaliza solo los .sql guardados; recuerda el hash normalizado de cada uno"""
+
+    def __init__(self, root_dir, backup=False, cache=None):
+        self.root_dir = os.path.abspath(root_dir)
+        self.backup = backup
+        self.cache = cache
+        self.digests = {}   # ruta -> hash de la salida normalizada
+
+    def handle(self, paths):
+        for path in sorted(paths):
+            if not path.lower().endswith('.sql') or not os.path.isfile(path):
+                self.digests.pop(path, None)
+                continue
+            start = time.perf_counter()
+            status, digest = sql_modif.normalize_file(path, self.digests.get(path), self.cache,
+                                                      backup=self.backup)
+            if digest is None:
+                self.digests.pop(path, None)
+            else:
+                # La propia reescritura genera un evento: con el hash se descarta sin analizar
+                self.digests[path] = digest
+            if status == 'modified':
+                sql_modif.print_colored('modified', f"MODIFICADO: {path} "
+                                        f"({(time.perf_counter() - start) * 1000:.0f} ms)")
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Vigila directorios y rehace solo los archivos que cambian')
+    parser.add_argument('--polling', action='store_true',
+                       help='Usar sondeo periódico en lugar de inotify')
+    parser.add_argument('--interval', type=float, default=POLL_INTERVAL,
+                       help='Segundos entre sondeos')
+    parser.add_argument('--debounce', type=float, default=WATCH_DEBOUNCE,
+                       help='Segundos sin eventos antes de procesar los cambios')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    compare = commands.add_parser('compare', help='Re-comparar pares al cambiar (filecompare)')
+    compare.add_argument('dir1', help='Directorio base')
+    compare.add_argument('dir2', help='Directorio modificado')
+    compare.add_argument('output_dir', nargs='?', default='evidencia_construccion',
+                        help='Directorio de salida (por defecto: evidencia_construccion)')
+    compare.add_argument('--context-lines', type=int, default=2,
+                        help='Líneas de contexto alrededor de cada cambio')
+    compare.add_argument('--max-gap', type=int, default=5,
+                        help='Distancia máxima para agrupar cambios en un mismo hunk')
+    compare.add_argument('--split-images', action='store_true',
+                        help='Dividir las imágenes que superen --max-height')
+    compare.add_argument('--max-height', type=int, default=1000,
+                        help='Altura máxima de cada imagen al dividir')
+    compare.add_argument('--extensions', nargs='+', dest='file_extensions',
+                        help='Procesar solo estas extensiones (ej: .py .cs)')
+    compare.add_argument('--engine', choices=filecompare.DIFF_ENGINES, default='myers',
+                        dest='diff_engine', help='Motor de diferencias (por defecto: myers)')
+    compare.add_argument('--format', choices=sorted(filecompare.RENDERERS), default='png',
+                        dest='renderer', help='Formato de salida (por defecto: png)')
+    compare.add_argument('--streaming', action='store_true',
+                        help='Procesar por ventanas con memoria acotada (archivos muy grandes)')
+    compare.add_argument('--no-cache', action='store_false', dest='result_cache',
+                        help='No reutilizar ni guardar resultados en caché')
+    compare.add_argument('--cache-max-mb', type=int,
+                        default=filecompare.RESULT_CACHE_MAX_BYTES >> 20,
+                        help='Tamaño máximo del caché de resultados en MB')
+    compare.add_argument('-r', '--recursive', action='store_true',
+                        help='Comparar también los subdirectorios')
+    compare.add_argument('--exclude', nargs='+',
+                        help='Patrones estilo .gitignore a excluir (por defecto: .git/ bin/ obj/)')
+    compare.add_argument('--initial', action='store_true',
+                        help='Hacer una comparación completa antes de empezar a vigilar')
+
+    sql = commands.add_parser('sql', help='Renormalizar los .sql al guardarlos (sql_modif)')
+    sql.add_argument('directory', help='Directorio a vigilar')
+    sql.add_argument('--backup', action='store_true',
+                    help='Conservar cada archivo modificado como .bak')
+    sql.add_argument('--memo', action='store_true',
+                    help='Memorizar la normalización por sentencia')
+    sql.add_argument('--initial', action='store_true',
+                    help='Normalizar todo el directorio antes de empezar a vigilar')
+
+    args = parser.parse_args()
+    if args.command == 'compare' and args.streaming and args.diff_engine == 'differ':
+        parser.error("--streaming no admite --engine differ (use myers o patience)")
+
+    if args.command == 'compare':
+        exclude = args.exclude
+        if exclude is None:
+            exclude = filecompare.DEFAULT_EXCLUDES if args.recursive else ()
+        file_extensions = None
+        if args.file_extensions:
+            file_extensions = [ext.lower() if ext.startswith('.') else f".{ext.lower()}"
+                               for ext in args.file_extensions]
+        cache = None
+        if args.result_cache:
+            cache = filecompare.ResultCache(
+                os.path.join(args.output_dir, filecompare.STATE_DIRNAME, 'results'),
+                args.cache_max_mb << 20)
+        options = filecompare.make_options(
+            args.context_lines, args.max_gap, int(args.split_images), args.max_height,
+            diff_engine=args.diff_engine, renderer=args.renderer, streaming=args.streaming,
+            result_cache=cache)
+        session = CompareSession(args.dir1, args.dir2, args.output_dir, options,
+                                 args.recursive, exclude, file_extensions)
+        if args.initial:
+            # Las salidas de la pasada inicial quedan registradas para poder borrarlas
+            filecompare.compare_directories(
+                args.dir1, args.dir2, args.output_dir, context_lines=args.context_lines,
+                max_gap=args.max_gap, split_images=int(args.split_images),
+                max_height=args.max_height, file_extensions=file_extensions,
+                diff_engine=args.diff_engine, recursive=args.recursive, exclude=exclude,
+                renderer=args.renderer, streaming=args.streaming,
+                result_cache=args.result_cache, cache_max_bytes=args.cache_max_mb << 20,
+                outputs=session.outputs)
+        roots = [args.dir1, args.dir2]
+        watcher = create_watcher(roots, args.recursive, exclude, args.polling, args.interval)
+    else:
+        cache = sql_modif.StatementCache() if args.memo else None
+        if args.initial:
+            sql_modif.process_directory(args.directory, backup=args.backup, cache=cache)
+        session = SqlSession(args.directory, args.backup, cache)
+        roots = [args.directory]
+        watcher = create_watcher(roots, True, (), args.polling, args.interval)
+
+    print(f"\nVigilando: {', '.join(os.path.abspath(root) for root in roots)} (Ctrl+C para salir)")
+    watch_loop(watcher, session.handle, args.debounce)
+
+if __name__ == "__main__":
+    main()